@@ -1,55 +1,53 @@
 import streamlit as st
 import pandas as pd
-import psycopg2
-import joblib
-import shutil
-from datetime import datetime
-
-DB = {
-    "host": "localhost",
-    "port": 5432,
-    "dbname": "mydb",
-    "user": "postgres",
-    "password": "mypassword"
-}
+import model_registry
+from db import get_conn
 
 def load_logs():
-    conn = psycopg2.connect(**DB)
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT timestamp, sample_count, f1_score, deployed
-        FROM model_training_log
-        ORDER BY timestamp DESC
-    """)
-    rows = cur.fetchall()
-    columns = [desc[0] for desc in cur.description]
-    cur.close()
-    conn.close()
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT id, timestamp, mode, sample_count, f1_score, feature_version, deployed, artifact_path, duration_s
+            FROM model_training_log
+            ORDER BY timestamp DESC
+        """)
+        rows = cur.fetchall()
+        columns = [desc[0] for desc in cur.description]
     return pd.DataFrame(rows, columns=columns)
 
-def promote_model(backup_name="dedup_model_backup.pkl"):
-    shutil.copy("dedup_model.pkl", backup_name)
-    st.success(f"✅ Model promoted manually and backed up to {backup_name}")
+def promote_model(version_id):
+    try:
+        load_seconds = model_registry.promote(version_id)
+    except Exception as e:
+        st.error(f"❌ Could not promote version {version_id}: {e}")
+        return False
+    st.success(f"✅ Promoted model version {version_id} (artifact loaded in {load_seconds:.2f}s). "
+               f"Running apps pick it up on their next registry check.")
+    return True
 
-def override_deployment_flag():
-    conn = psycopg2.connect(**DB)
-    cur = conn.cursor()
-    cur.execute("""
-        UPDATE model_training_log
-        SET deployed = TRUE
-        WHERE id = (
-            SELECT id FROM model_training_log
-            ORDER BY timestamp DESC
-            LIMIT 1
-        )
-    """)
-    conn.commit()
-    cur.close()
-    conn.close()
+def override_deployment_flag(logs_df):
+    # Registered runs go through the registry; legacy rows without an artifact
+    # only get their flag set, still as the only deployed row
+    if not logs_df.empty and pd.notna(logs_df.iloc[0]["artifact_path"]):
+        return promote_model(int(logs_df.iloc[0]["id"]))
+
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            UPDATE model_training_log
+            SET deployed = (id = latest.id)
+            FROM (
+                SELECT id FROM model_training_log
+                ORDER BY timestamp DESC
+                LIMIT 1
+            ) latest
+            WHERE deployed OR model_training_log.id = latest.id
+        """)
+    st.success("Deployment flag updated in log table")
+    return True
 
 st.set_page_config(layout="wide")
 st.title("📊 Model Training Admin Dashboard")
 
+model_registry.ensure_registry()
 logs_df = load_logs()
 
 st.subheader("📈 Training History")
@@ -60,10 +58,19 @@ st.subheader("🔧 Manual Actions")
 col1, col2 = st.columns(2)
 
 with col1:
-    if st.button("Promote Current Model"):
-        promote_model()
+    versions = logs_df[logs_df["artifact_path"].notna()]
+    version_id = st.selectbox(
+        "Model version",
+        versions["id"].tolist(),
+        format_func=lambda v: "v%s — %s%s" % (
+            v,
+            versions.loc[versions["id"] == v, "timestamp"].iloc[0],
+            " (deployed)" if versions.loc[versions["id"] == v, "deployed"].iloc[0] else ""
+        )
+    )
+    if st.button("Promote Selected Model") and version_id is not None:
+        promote_model(int(version_id))
 
 with col2:
     if st.button("Force Last Run as Deployed"):
-        override_deployment_flag()
-        st.success("Deployment flag updated in log table")
+        override_deployment_flag(logs_df)
@@ -0,0 +1,269 @@
+# ann_index.py
+#
+# Approximate-nearest-neighbour indexes on people_with_faces.face_embedding
+# (pgvector HNSW / IVFFlat) and the per-query search knobs used by
+# vector_search. The operator class follows VECTOR_DISTANCE so the index
+# matches the operator find_similar_faces orders by; CLIP embeddings are
+# L2-normalized, so l2 and cosine give the same ranking.
+#
+#   python ann_index.py create --method hnsw --m 16 --ef-construction 64
+#   python ann_index.py rebuild --method ivfflat --lists 1000 --concurrently
+#   python ann_index.py list
+#   python ann_index.py report --k 10 --ef-search 10 20 40 80 160 --probes 1 5 10 20
+
+import argparse
+import math
+import os
+import time
+import numpy as np
+from psycopg2 import sql
+from db import get_conn
+
+TABLE = "people_with_faces"
+COLUMN = "face_embedding"
+
+# distance -> (operator class, ORDER BY operator)
+DISTANCES = {
+    "l2": ("vector_l2_ops", "<->"),
+    "cosine": ("vector_cosine_ops", "<=>"),
+    "ip": ("vector_ip_ops", "<#>"),
+}
+METHODS = ("hnsw", "ivfflat")
+VECTOR_DISTANCE = os.environ.get("VECTOR_DISTANCE", "l2")
+
+# Search defaults; find_similar_faces raises ef_search to at least top_k,
+# since HNSW never returns more than ef_search rows
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", 40))
+IVFFLAT_PROBES = int(os.environ.get("IVFFLAT_PROBES", 10))
+
+def distance_operator(distance=None):
+    return DISTANCES[distance or VECTOR_DISTANCE][1]
+
+def index_name(method, distance):
+    return f"{TABLE}_{COLUMN}_{method}_{distance}_idx"
+
+def default_lists(row_count):
+    # pgvector guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond
+    if row_count <= 1_000_000:
+        return max(1, row_count // 1000)
+    return int(math.sqrt(row_count))
+
+def search_settings(top_k, ef_search=None, probes=None, exact=False):
+    # GUC -> value for one ANN query
+    if exact:
+        return {"enable_indexscan": "off"}
+    return {
+        "hnsw.ef_search": str(int(max(ef_search or HNSW_EF_SEARCH, top_k))),
+        "ivfflat.probes": str(int(probes or IVFFLAT_PROBES)),
+    }
+
+def apply_search_params(cur, top_k, ef_search=None, probes=None, exact=False):
+    # Transaction-local (set_config(..., true)), so pooled connections never
+    # carry one request's settings into the next
+    settings = search_settings(top_k, ef_search, probes, exact)
+    cur.execute(
+        "SELECT " + ", ".join("set_config(%s, %s, true)" for _ in settings),
+        [v for item in settings.items() for v in item]
+    )
+
+def _ann_indexes(cur):
+    cur.execute("""
+        SELECT i.indexname, i.indexdef, pg_relation_size(c.oid) AS size_bytes
+        FROM pg_indexes i
+        JOIN pg_class c ON c.relname = i.indexname
+        WHERE i.tablename = %s
+          AND (i.indexdef ILIKE '%%USING hnsw%%' OR i.indexdef ILIKE '%%USING ivfflat%%')
+        ORDER BY i.indexname
+    """, (TABLE,))
+    return cur.fetchall()
+
+def list_indexes():
+    with get_conn() as conn, conn.cursor() as cur:
+        return _ann_indexes(cur)
+
+def _row_count(cur):
+    cur.execute(sql.SQL("SELECT count(*) FROM {} WHERE {} IS NOT NULL").format(
+        sql.Identifier(TABLE), sql.Identifier(COLUMN)))
+    return cur.fetchone()[0]
+
+def _create_statement(name, method, distance, m, ef_construction, lists, concurrently):
+    if method == "hnsw":
+        options = sql.SQL("m = {}, ef_construction = {}").format(sql.Literal(int(m)), sql.Literal(int(ef_construction)))
+    else:
+        options = sql.SQL("lists = {}").format(sql.Literal(int(lists)))
+    return sql.SQL("CREATE INDEX {concurrently} IF NOT EXISTS {name} ON {table} USING {method} ({column} {opclass}) WITH ({options})").format(
+        concurrently=sql.SQL("CONCURRENTLY" if concurrently else ""),
+        name=sql.Identifier(name),
+        table=sql.Identifier(TABLE),
+        method=sql.SQL(method),
+        column=sql.Identifier(COLUMN),
+        opclass=sql.SQL(DISTANCES[distance][0]),
+        options=options,
+    )
+
+def create_index(method="hnsw", distance=None, m=16, ef_construction=64, lists=None,
+                 concurrently=False, maintenance_work_mem=None, rebuild=False):
+    # With rebuild, the new index is built under a temporary name before any
+    # existing ANN index on the column is dropped, so searches never lose it.
+    # Without it, an existing index of the same name is left alone.
+    if method not in METHODS:
+        raise ValueError(f"Unknown index method {method!r}, expected one of {METHODS}")
+    distance = distance or VECTOR_DISTANCE
+    name = index_name(method, distance)
+
+    with get_conn() as conn:
+        # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                existing = [row[0] for row in _ann_indexes(cur)]
+                if not rebuild:
+                    if name in existing:
+                        print(f"⚠️ {name} already exists; use `python ann_index.py rebuild` to rebuild it")
+                        return name
+                    if existing:
+                        print(f"⚠️ face_embedding already has ANN index(es) {', '.join(existing)}; "
+                              f"adding {name} alongside them (use `rebuild` to replace them)")
+                    existing = []
+
+                if maintenance_work_mem:
+                    cur.execute("SELECT set_config('maintenance_work_mem', %s, false)", (maintenance_work_mem,))
+                if method == "ivfflat" and not lists:
+                    lists = default_lists(_row_count(cur))
+
+                build_name = name + "_new" if name in existing else name
+                if build_name != name:
+                    # Leftover from an interrupted rebuild
+                    cur.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(build_name)))
+
+                t0 = time.time()
+                cur.execute(_create_statement(build_name, method, distance, m, ef_construction, lists, concurrently))
+                build_seconds = time.time() - t0
+
+                for old in existing:
+                    if old != build_name:
+                        cur.execute(sql.SQL("DROP INDEX {} IF EXISTS {}").format(
+                            sql.SQL("CONCURRENTLY" if concurrently else ""), sql.Identifier(old)))
+                if build_name != name:
+                    cur.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(sql.Identifier(build_name), sql.Identifier(name)))
+                cur.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(TABLE)))
+        finally:
+            if maintenance_work_mem and not conn.closed:
+                with conn.cursor() as cur:
+                    cur.execute("RESET maintenance_work_mem")
+            conn.autocommit = False
+
+    params = f"m={m}, ef_construction={ef_construction}" if method == "hnsw" else f"lists={lists}"
+    print(f"✅ Built {name} ({method}, {DISTANCES[distance][0]}, {params}) in {build_seconds:.1f}s")
+    return name
+
+def drop_indexes():
+    with get_conn() as conn, conn.cursor() as cur:
+        dropped = [row[0] for row in _ann_indexes(cur)]
+        for name in dropped:
+            cur.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(name)))
+    return dropped
+
+def _knn_ids(cur, vec, k, distance):
+    cur.execute(sql.SQL("""
+        SELECT id
+        FROM {table}, (SELECT %s::vector AS vec) q
+        ORDER BY {column} {op} q.vec
+        LIMIT %s
+    """).format(table=sql.Identifier(TABLE), column=sql.Identifier(COLUMN), op=sql.SQL(DISTANCES[distance][1])),
+        (vec, k))
+    return [row[0] for row in cur.fetchall()]
+
+def _timed_search(queries, k, distance, **params):
+    results, timings = [], []
+    with get_conn() as conn:
+        for vec in queries:
+            with conn.cursor() as cur:
+                t0 = time.perf_counter()
+                apply_search_params(cur, k, **params)
+                results.append(_knn_ids(cur, vec, k, distance))
+                timings.append(time.perf_counter() - t0)
+            # End the transaction so set_config(..., true) does not leak
+            conn.commit()
+    return results, np.array(timings) * 1000
+
+def _uses_index(vec, k, distance, **params):
+    with get_conn() as conn, conn.cursor() as cur:
+        apply_search_params(cur, k, **params)
+        cur.execute(sql.SQL("EXPLAIN SELECT id FROM {table}, (SELECT %s::vector AS vec) q ORDER BY {column} {op} q.vec LIMIT %s").format(
+            table=sql.Identifier(TABLE), column=sql.Identifier(COLUMN), op=sql.SQL(DISTANCES[distance][1])), (vec, k))
+        plan = "\n".join(row[0] for row in cur.fetchall())
+    return "Index Scan" in plan
+
+def recall_report(sample=100, k=10, ef_search_values=(10, 20, 40, 80, 160), probes_values=(1, 5, 10, 20, 50), distance=None):
+    # recall@k of the ANN path against an exact (sequential-scan) search on
+    # stored embeddings used as queries, with median / p95 latency per setting
+    distance = distance or VECTOR_DISTANCE
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(sql.SQL("SELECT {column} FROM {table} WHERE {column} IS NOT NULL ORDER BY random() LIMIT %s").format(
+            column=sql.Identifier(COLUMN), table=sql.Identifier(TABLE)), (sample,))
+        queries = [row[0] for row in cur.fetchall()]
+    if not queries:
+        print("⚠️ No embeddings to sample")
+        return []
+
+    indexes = list_indexes()
+    print(f"📊 {len(queries)} queries, k={k}, distance={distance}, indexes: {', '.join(r[0] for r in indexes) or 'none'}")
+    if not _uses_index(queries[0], k, distance):
+        print(f"⚠️ Planner is not using an ANN index for {DISTANCES[distance][1]}; results below are exact")
+
+    truth, exact_ms = _timed_search(queries, k, distance, exact=True)
+    rows = [{"setting": "exact", "recall": 1.0, "p50_ms": np.median(exact_ms), "p95_ms": np.percentile(exact_ms, 95)}]
+
+    methods = " ".join(r[1] for r in indexes)
+    settings = []
+    if "hnsw" in methods:
+        settings += [(f"ef_search={v}", {"ef_search": v}) for v in ef_search_values]
+    if "ivfflat" in methods:
+        settings += [(f"probes={v}", {"probes": v}) for v in probes_values]
+
+    for label, params in settings:
+        found, ms = _timed_search(queries, k, distance, **params)
+        recall = np.mean([len(set(f) & set(t)) / max(1, len(t)) for f, t in zip(found, truth)])
+        rows.append({"setting": label, "recall": recall, "p50_ms": np.median(ms), "p95_ms": np.percentile(ms, 95)})
+
+    print(f"{'setting':>16} {'recall@' + str(k):>10} {'p50 ms':>10} {'p95 ms':>10}")
+    for r in rows:
+        print(f"{r['setting']:>16} {r['recall']:>10.3f} {r['p50_ms']:>10.2f} {r['p95_ms']:>10.2f}")
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage and tune ANN indexes on people_with_faces.face_embedding")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    for cmd in ("create", "rebuild"):
+        p = sub.add_parser(cmd)
+        p.add_argument("--method", choices=METHODS, default="hnsw")
+        p.add_argument("--distance", choices=sorted(DISTANCES), default=VECTOR_DISTANCE)
+        p.add_argument("--m", type=int, default=16)
+        p.add_argument("--ef-construction", type=int, default=64)
+        p.add_argument("--lists", type=int, help="IVFFlat lists (default: rows/1000, sqrt(rows) above 1M)")
+        p.add_argument("--concurrently", action="store_true", help="build without blocking writes")
+        p.add_argument("--maintenance-work-mem", help="e.g. 2GB; HNSW builds are much faster when the graph fits")
+
+    sub.add_parser("list")
+    sub.add_parser("drop")
+
+    p = sub.add_parser("report")
+    p.add_argument("--sample", type=int, default=100)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--distance", choices=sorted(DISTANCES), default=VECTOR_DISTANCE)
+    p.add_argument("--ef-search", type=int, nargs="+", default=[10, 20, 40, 80, 160])
+    p.add_argument("--probes", type=int, nargs="+", default=[1, 5, 10, 20, 50])
+
+    args = parser.parse_args()
+    if args.command in ("create", "rebuild"):
+        create_index(args.method, args.distance, args.m, args.ef_construction, args.lists,
+                     args.concurrently, args.maintenance_work_mem, rebuild=args.command == "rebuild")
+    elif args.command == "list":
+        for name, indexdef, size in list_indexes():
+            print(f"{name} ({size / 1e6:.1f} MB)\n    {indexdef}")
+    elif args.command == "drop":
+        print(f"✅ Dropped {drop_indexes() or 'no ANN indexes'}")
+    else:
+        recall_report(args.sample, args.k, args.ef_search, args.probes, args.distance)
@@ -2,14 +2,11 @@ import streamlit as st
 import pandas as pd
 import base64
 from datetime import datetime
-from nicknames import load_nickname_map_from_db, normalize_name
 from hybrid_search import rerank_with_text
-from vector_search import find_similar_faces, find_similar_textual
-from embedding_cache import encode_image_b64_to_vector
+from vector_search import fetch_headshots
+from async_retrieval import retrieve_candidates
 from scoring_model import score_with_explanation
 
-nickname_map = load_nickname_map_from_db()
-
 st.set_page_config(layout="wide")
 st.title("🔍 Hybrid Duplicate Finder")
 
@@ -25,36 +22,35 @@ with st.form("dedupe_form"):
 if submit:
     st.info("🔎 Searching for potential duplicates...")
 
-    norm_first = normalize_name(first_nm, nickname_map)
+    birth_str = birth_dt.strftime("%Y-%m-%d")
+    b64_img = base64.b64encode(headshot.getvalue()).decode("utf-8") if headshot else None
+
+    # The headshot is CLIP-encoded while the nickname lookup and the
+    # text / blocking query run; the image query follows as soon as the
+    # vector is ready. Sources are deduplicated and fused by rrf_score.
+    candidates, img_vec, norm_first = retrieve_candidates(
+        b64_img, first_nm, last_nm, email, mdm_id, birth_str,
+        image_k=50, text_k=50, block_k=50, with_embedding=True
+    )
 
     # Start building query fields
     input_record = {
         "first_nm": norm_first,
         "last_nm": last_nm,
-        "birth_dt": birth_dt.strftime("%Y-%m-%d"),
+        "birth_dt": birth_str,
         "email_address": email,
         "mdm_person_id": mdm_id,
-        "headshot_b64": None,
-        "embedding": None
+        "headshot_b64": b64_img,
+        "embedding": img_vec
     }
 
-    candidates = pd.DataFrame()
-
-    # Image-based candidate retrieval
-    if headshot:
-        b64_img = base64.b64encode(headshot.getvalue()).decode("utf-8")
-        img_vec = encode_image_b64_to_vector(b64_img)
-        input_record["headshot_b64"] = b64_img
-        input_record["embedding"] = img_vec
-        candidates = find_similar_faces(img_vec, top_k=50)
-
-    # Textual-based fallback or merge
-    text_candidates = find_similar_textual(norm_first, last_nm, email, mdm_id, birth_dt.strftime("%Y-%m-%d"), top_k=50)
-    candidates = pd.concat([candidates, text_candidates]).drop_duplicates("person_id")
-
     # Rerank with trained model
     reranked = rerank_with_text(input_record, candidates)
 
+    # Candidates are scored from their stored embeddings; headshots are only
+    # fetched for rows without one and, below, for the matches displayed
+    images = fetch_headshots(reranked.loc[reranked["face_embedding"].isna(), "person_id"]) if not reranked.empty else {}
+
     pairs = []
     for _, row in reranked.iterrows():
         pairs.append({
@@ -71,11 +67,15 @@ if submit:
             'a_mdm': mdm_id,
             'b_mdm': row['mdm_person_id'],
             'a_img': input_record['headshot_b64'],
-            'b_img': row['headshot_b64']
+            'b_img': images.get(row['person_id']),
+            'a_embedding': input_record['embedding'],
+            'b_embedding': row['face_embedding']
         })
 
     scored = score_with_explanation(pd.DataFrame(pairs))
     top_n = scored.sort_values("score", ascending=False).head(5)
+    images.update(fetch_headshots(top_n["b_id"]))
+    top_n["b_img"] = top_n["b_id"].map(images)
 
     st.subheader(f"🧠 Top {len(top_n)} Matches")
     for i, row in top_n.iterrows():
@@ -89,7 +89,7 @@ if submit:
             col2.image(base64.b64decode(row['b_img']), width=128)
 
         st.markdown("**Feature Contributions:**")
-        features = row[[c for c in row.index if c.startswith("feat_")]]
-        st.dataframe(features.to_frame().T.rename(columns=lambda x: x.replace("feat_", "")), use_container_width=True)
+        contribs = row[[c for c in row.index if c.startswith("contrib_")]]
+        st.dataframe(contribs.to_frame().T.rename(columns=lambda x: x.replace("contrib_", "")), use_container_width=True)
 
         st.markdown("---")
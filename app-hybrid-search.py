@@ -4,43 +4,30 @@ import base64
 from datetime import datetime
 from PIL import Image
 from io import BytesIO
-from nicknames import load_nickname_map_from_db, normalize_name
 from hybrid_search import rerank_with_text
-from vector_search import find_similar_faces
-from embedding_cache import encode_image_b64_to_vector
+from vector_search import fetch_headshots
+from async_retrieval import retrieve_candidates
 from scoring_model import score_with_explanation
-
-DB = {
-    "host": "localhost",
-    "port": 5432,
-    "dbname": "mydb",
-    "user": "postgres",
-    "password": "mypassword"
-}
+from db import get_conn
 
 def log_user_feedback(input_record, match_id, score, label):
-    import psycopg2
-    conn = psycopg2.connect(**DB)
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS user_feedback_log (
-            id SERIAL PRIMARY KEY,
-            input_first TEXT, input_last TEXT, input_dob DATE, input_img TEXT,
-            matched_id INT, match_score FLOAT, label INT
-        );
-    """)
-    cur.execute("""
-        INSERT INTO user_feedback_log (
-            input_first, input_last, input_dob, input_img,
-            matched_id, match_score, label
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-    """, (
-        input_record["first_nm"], input_record["last_nm"], input_record["birth_dt"], input_record["headshot_b64"],
-        match_id, score, label
-    ))
-    conn.commit()
-    cur.close()
-    conn.close()
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS user_feedback_log (
+                id SERIAL PRIMARY KEY,
+                input_first TEXT, input_last TEXT, input_dob DATE, input_img TEXT,
+                matched_id INT, match_score FLOAT, label INT
+            );
+        """)
+        cur.execute("""
+            INSERT INTO user_feedback_log (
+                input_first, input_last, input_dob, input_img,
+                matched_id, match_score, label
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, (
+            input_record["first_nm"], input_record["last_nm"], input_record["birth_dt"], input_record["headshot_b64"],
+            match_id, score, label
+        ))
 
 st.set_page_config(layout="centered")
 st.title("🔍 Hybrid Duplicate Finder")
@@ -57,12 +44,12 @@ with st.form("dedupe_form"):
 if submit and headshot:
     st.info("Processing search and scoring...")
     b64_img = base64.b64encode(headshot.getvalue()).decode("utf-8")
-    img_vec = encode_image_b64_to_vector(b64_img)
+    # CLIP encode and the nickname lookup run concurrently; the image query
+    # starts as soon as the vector is ready
+    candidates, img_vec, norm_first = retrieve_candidates(
+        b64_img, first_nm, image_k=10, text_k=0, block_k=0, top_k=10, with_embedding=True
+    )
 
-    norm_first = normalize_name(first_nm, load_nickname_map_from_db())
-    
-    candidates = find_similar_faces(img_vec, top_k=10)
-    
     reranked = rerank_with_text({
         "first_nm": norm_first,
         "last_nm": last_nm,
@@ -70,6 +57,10 @@ if submit and headshot:
         "email_address": email
     }, candidates)
 
+    # Candidates are scored from their stored embeddings; headshots are only
+    # fetched for rows without one and, below, for the top match
+    images = fetch_headshots(reranked.loc[reranked["face_embedding"].isna(), "person_id"]) if not reranked.empty else {}
+
     pairs = []
     for _, row in reranked.iterrows():
         pairs.append({
@@ -86,24 +77,28 @@ if submit and headshot:
             'a_mdm': mdm_id,
             'b_mdm': row['mdm_person_id'],
             'a_img': b64_img,
-            'b_img': row['headshot_b64']
+            'b_img': images.get(row['person_id']),
+            'a_embedding': img_vec,
+            'b_embedding': row['face_embedding']
         })
 
     scored = score_with_explanation(pd.DataFrame(pairs))
     top = scored.sort_values("score", ascending=False).iloc[0]
+    top_img = images.get(top['b_id']) or fetch_headshots([top['b_id']]).get(top['b_id'])
 
     st.subheader(f"Top Match: {top['b_first']} {top['b_last']} — Score: {top['score']:.3f}")
     col1, col2 = st.columns(2)
     col1.image(base64.b64decode(top['a_img']), caption="Your Input", width=128)
     
-    col2.image(base64.b64decode(top['b_img']), width=128)
+    if top_img:
+        col2.image(base64.b64decode(top_img), width=128)
     col2.markdown(f"**Name:** {top['b_first']} {top['b_last']}\n"
                   f"**MDM ID:** {top['b_mdm']}\n"
                   f"**Email:** {top['b_email']}\n"
                   f"**Birth Date:** {top['b_birth']}\n")
 
     st.markdown("#### Feature Contributions")
-    st.dataframe(top[[c for c in top.index if c.startswith("feat_")]].to_frame().T.rename(columns=lambda x: x.replace("feat_", "")))
+    st.dataframe(top[[c for c in top.index if c.startswith("contrib_")]].to_frame().T.rename(columns=lambda x: x.replace("contrib_", "")))
 
     if st.button("✅ Confirm Match"):
         log_user_feedback({
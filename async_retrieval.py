@@ -0,0 +1,171 @@
+# async_retrieval.py
+#
+# Concurrent candidate retrieval on asyncpg. The CLIP encode runs in a thread
+# executor while the nickname lookup and the text / blocking query run on the
+# async pool; the image query starts as soon as the vector is ready. Latency
+# approaches max(encode, text query) + image query instead of the sum of
+# every step.
+#
+# The SQL is the same as vector_search's (hybrid_candidates_sql), converted
+# from %(name)s to asyncpg's $n placeholders. Vectors go over the wire with
+# the pgvector binary codec.
+#
+# Streamlit is synchronous, so retrieve_candidates() submits the coroutine to
+# one persistent event loop on a background thread; the asyncpg pool lives on
+# that loop and is shared by every session.
+
+import asyncio
+import os
+import re
+import threading
+from datetime import date
+import asyncpg
+import numpy as np
+import pandas as pd
+from pgvector.asyncpg import register_vector
+from db import DB, POOL_MIN, POOL_MAX
+from ann_index import search_settings
+from embedding_cache import encode_image_b64_to_vector
+from vector_search import hybrid_candidates_sql, TRGM_THRESHOLD, RRF_K
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%%")
+
+def to_asyncpg(query, params):
+    # "%(name)s" -> "$n" (a repeated name reuses its number), "%%" -> "%"
+    names = []
+
+    def sub(m):
+        if m.group(0) == "%%":
+            return "%"
+        if m.group(1) not in names:
+            names.append(m.group(1))
+        return f"${names.index(m.group(1)) + 1}"
+
+    return _PLACEHOLDER.sub(sub, query), [params[name] for name in names]
+
+async def _init_connection(conn):
+    try:
+        await register_vector(conn)
+    except ValueError as e:
+        print(f"⚠️ pgvector codec not registered: {e}")
+
+class AsyncRetriever:
+    # Owns the background event loop and the asyncpg pool bound to it
+
+    def __init__(self):
+        self._loop = None
+        self._pid = None
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def loop(self):
+        if self._loop is None or self._pid != os.getpid():
+            with self._lock:
+                if self._loop is None or self._pid != os.getpid():
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name="async-retrieval", daemon=True).start()
+                    self._loop, self._pid, self._pool = loop, os.getpid(), None
+        return self._loop
+
+    async def pool(self):
+        # Only ever touched from the loop thread, so no lock is needed here
+        if self._pool is None:
+            self._pool = await asyncpg.create_pool(
+                host=DB["host"], port=DB["port"], database=DB["dbname"],
+                user=DB["user"], password=DB["password"],
+                min_size=POOL_MIN, max_size=POOL_MAX, init=_init_connection,
+            )
+        return self._pool
+
+    def run(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop()).result(timeout)
+
+retriever = AsyncRetriever()
+
+async def fetch_df(query, params, settings=None):
+    # Runs one %(name)s query on the pool; settings are applied
+    # transaction-locally in the same transaction
+    sql, args = to_asyncpg(query, params)
+    pool = await retriever.pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if settings:
+                await conn.execute(
+                    "SELECT " + ", ".join(f"set_config(${2 * i + 1}, ${2 * i + 2}, true)" for i in range(len(settings))),
+                    *[v for item in settings.items() for v in item]
+                )
+            rows = await conn.fetch(sql, *args)
+    if not rows:
+        return pd.DataFrame()
+    return pd.DataFrame([tuple(r.values()) for r in rows], columns=list(rows[0].keys()))
+
+async def canonical_first_name(first_nm):
+    # Same result as nicknames.normalize_name, but looks up one name instead
+    # of loading the whole nickname map. Duplicate nicknames resolve like the
+    # SQL canonical_first_name (schema.py); a missing nicknames table falls
+    # back to the name as entered.
+    if not first_nm:
+        return first_nm
+    name = first_nm.lower()
+    pool = await retriever.pool()
+    try:
+        canonical = await pool.fetchval(
+            "SELECT canonical FROM nicknames WHERE lower(nickname) = $1 ORDER BY canonical LIMIT 1", name
+        )
+    except asyncpg.PostgresError as e:
+        print(f"⚠️ Nickname lookup failed, using the name as entered: {e}")
+        return name
+    return canonical.lower() if canonical else name
+
+def fuse_candidates(frames, top_k, rrf_k=RRF_K):
+    # Client-side version of the SQL fusion in hybrid_candidates_sql for
+    # sources fetched by separate concurrent queries
+    frames = [f for f in frames if f is not None and not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    merged = pd.concat(frames, ignore_index=True).groupby("id", sort=False).first().reset_index()
+    rank_cols = [c for c in merged.columns if c.endswith("_rank")]
+    merged["rrf_score"] = sum(
+        (1.0 / (rrf_k + merged[c].astype(float))).fillna(0.0) for c in rank_cols
+    )
+    return merged.sort_values("rrf_score", ascending=False).head(top_k).drop(columns="id").reset_index(drop=True)
+
+async def retrieve_candidates_async(b64_img=None, first_nm=None, last_nm=None, email=None, mdm=None, dob=None,
+                                    image_k=50, text_k=50, block_k=50, top_k=100, with_embedding=True,
+                                    ef_search=None, probes=None, min_similarity=None):
+    # Returns (candidates, query vector or None, normalized first name)
+    loop = asyncio.get_running_loop()
+    if isinstance(dob, str) and dob:
+        dob = date.fromisoformat(dob)
+
+    encode = loop.run_in_executor(None, encode_image_b64_to_vector, b64_img) if b64_img else None
+
+    async def image_candidates():
+        vec = await encode
+        query, params = hybrid_candidates_sql(np.asarray(vec, dtype=np.float32), image_k=image_k, text_k=0,
+                                              block_k=0, top_k=image_k, with_embedding=with_embedding)
+        df = await fetch_df(query, params, search_settings(image_k, ef_search, probes))
+        return vec, df
+
+    async def text_candidates():
+        # The normalized name is for the trigram text source only; blocking
+        # keys are computed from the name as entered
+        norm_first = await canonical_first_name(first_nm)
+        query, params = hybrid_candidates_sql(None, norm_first, last_nm, email, mdm, dob, image_k=0,
+                                              text_k=text_k, block_k=block_k, top_k=text_k + block_k,
+                                              with_embedding=with_embedding, block_first_nm=first_nm)
+        if query is None:
+            return norm_first, None
+        settings = {"pg_trgm.similarity_threshold": str(min_similarity or TRGM_THRESHOLD)}
+        return norm_first, await fetch_df(query, params, settings)
+
+    tasks = [text_candidates()] + ([image_candidates()] if encode is not None else [])
+    results = await asyncio.gather(*tasks)
+    norm_first, text_df = results[0]
+    vec, image_df = results[1] if encode is not None else (None, None)
+
+    return fuse_candidates([image_df, text_df], top_k), vec, norm_first
+
+def retrieve_candidates(*args, timeout=None, **kwargs):
+    # Sync entry point for the Streamlit apps
+    return retriever.run(retrieve_candidates_async(*args, **kwargs), timeout)
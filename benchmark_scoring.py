@@ -0,0 +1,59 @@
+# benchmark_scoring.py
+#
+# Compares the original pandas/sklearn-wrapper scoring path with the native
+# booster path (scoring_model.score_matrix) on synthetic feature batches.
+#
+#   python benchmark_scoring.py --sizes 1 10 100 10000
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from extract_features import FEATURE_COLUMNS
+from scoring_model import get_model, score_matrix
+
+def random_features(n, rng):
+    X = rng.random((n, len(FEATURE_COLUMNS)), dtype=np.float32)
+    for i, col in enumerate(FEATURE_COLUMNS):
+        if col.endswith("_match"):
+            X[:, i] = X[:, i] > 0.5
+    return X
+
+def legacy_path(X):
+    # What score_with_explanation used to do: list of dicts -> DataFrame ->
+    # predict_proba -> write feat_* columns back -> sort
+    rows = [dict(zip(FEATURE_COLUMNS, row)) for row in X.tolist()]
+    df = pd.DataFrame(rows)
+    X_df = df[FEATURE_COLUMNS]
+    df['score'] = get_model().classifier.predict_proba(X_df)[:, 1]
+    for col in FEATURE_COLUMNS:
+        df[f"feat_{col}"] = X_df[col]
+    return df.sort_values("score", ascending=False)
+
+def native_path(X):
+    scores = score_matrix(X)
+    return np.argsort(-scores)
+
+def time_call(fn, X, repeats):
+    fn(X)  # warm-up
+    timings = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn(X)
+        timings.append(time.perf_counter() - t0)
+    return np.median(timings) * 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark dedup scoring paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 10000])
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    print(f"{'batch':>8} {'legacy ms':>12} {'native ms':>12} {'speedup':>9}")
+    for n in args.sizes:
+        X = random_features(n, rng)
+        repeats = max(3, args.repeats if n < 10000 else args.repeats // 10)
+        legacy = time_call(legacy_path, X, repeats)
+        native = time_call(native_path, X, repeats)
+        print(f"{n:>8} {legacy:>12.3f} {native:>12.3f} {legacy / native:>8.1f}x")
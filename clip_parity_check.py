@@ -0,0 +1,85 @@
+# clip_parity_check.py
+#
+# Compares a CLIP image-encoder backend against the fp32 embeddings already
+# stored in people_with_faces.face_embedding, so a faster backend can be
+# adopted without re-embedding the table.
+#
+#   python clip_parity_check.py --backend torch-int8 --sample 500
+
+import argparse
+import base64
+import time
+import numpy as np
+from io import BytesIO
+from PIL import Image
+import clip_provider
+from embedding_cache import parse_embedding
+from db import get_conn
+
+def fetch_sample(n):
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT person_id, headshot_b64, face_embedding
+            FROM people_with_faces
+            WHERE headshot_b64 IS NOT NULL AND face_embedding IS NOT NULL
+            ORDER BY random()
+            LIMIT %s
+        """, (n,))
+        rows = cur.fetchall()
+    return rows
+
+def run_parity_check(backend, sample=200, batch_size=32):
+    clip_provider.configure(backend=backend)
+    rows = fetch_sample(sample)
+    if not rows:
+        print("⚠️ No rows with both headshot and embedding found")
+        return None
+
+    stored = np.stack([parse_embedding(r[2]) for r in rows])
+    stored /= np.linalg.norm(stored, axis=1, keepdims=True)
+
+    # Warm up outside the timed loop so model load/export isn't counted
+    clip_provider.get_image_encoder()
+
+    encoded = []
+    t0 = time.time()
+    for start in range(0, len(rows), batch_size):
+        images = [Image.open(BytesIO(base64.b64decode(r[1]))).convert("RGB") for r in rows[start:start + batch_size]]
+        encoded.append(clip_provider.encode_pil_images(images))
+    elapsed = time.time() - t0
+    encoded = np.concatenate(encoded)
+
+    cos = np.sum(stored * encoded, axis=1)
+    report = {
+        "backend": backend,
+        "samples": len(rows),
+        "images_per_sec": len(rows) / elapsed,
+        "mean_cosine": float(cos.mean()),
+        "p01_cosine": float(np.percentile(cos, 1)),
+        "min_cosine": float(cos.min()),
+        "max_drift": float(1.0 - cos.min()),
+        "worst_person_id": rows[int(cos.argmin())][0],
+    }
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check CLIP backend parity against stored fp32 embeddings")
+    parser.add_argument("--backend", choices=clip_provider.BACKENDS, default=clip_provider.CLIP_BACKEND)
+    parser.add_argument("--sample", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--min-cosine", type=float, default=0.99,
+                        help="fail if any sampled image falls below this cosine similarity")
+    args = parser.parse_args()
+
+    report = run_parity_check(args.backend, args.sample, args.batch_size)
+    if report is None:
+        exit(1)
+
+    print("📊 CLIP parity report")
+    for k, v in report.items():
+        print(f"  {k}: {v:.4f}" if isinstance(v, float) else f"  {k}: {v}")
+
+    if report["min_cosine"] < args.min_cosine:
+        print(f"❌ Backend {args.backend} drifts below {args.min_cosine} cosine vs stored embeddings")
+        exit(1)
+    print(f"✅ Backend {args.backend} is within {args.min_cosine} cosine of stored embeddings")
@@ -0,0 +1,161 @@
+# clip_provider.py
+
+import os
+import threading
+import time
+import numpy as np
+
+MODEL_NAME = os.environ.get("CLIP_MODEL", "openai/clip-vit-base-patch32")
+MODEL_REVISION = os.environ.get("CLIP_MODEL_REVISION", "main")
+
+# Device defaults to cuda when available; 0 threads leaves the runtime's default
+CLIP_DEVICE = os.environ.get("CLIP_DEVICE") or None
+CLIP_NUM_THREADS = int(os.environ.get("CLIP_NUM_THREADS", 0))
+
+# Image encoder backend: "torch" (fp32), "torch-int8" (dynamic quantization, CPU)
+# or "onnx" (ONNX Runtime, exported to CLIP_ONNX_PATH on first use)
+BACKENDS = ("torch", "torch-int8", "onnx")
+CLIP_BACKEND = os.environ.get("CLIP_BACKEND", "torch")
+CLIP_ONNX_PATH = os.environ.get("CLIP_ONNX_PATH", "clip_image_encoder.onnx")
+
+_lock = threading.RLock()
+_clip = None
+_processor = None
+_config = None
+_encoder = None
+
+def configure(device=None, num_threads=None, backend=None):
+    # Must be called before the first encode to have any effect
+    global CLIP_DEVICE, CLIP_NUM_THREADS, CLIP_BACKEND
+    if device is not None:
+        CLIP_DEVICE = device
+    if num_threads is not None:
+        CLIP_NUM_THREADS = num_threads
+    if backend is not None:
+        if backend not in BACKENDS:
+            raise ValueError("unknown CLIP backend %r, expected one of %s" % (backend, BACKENDS))
+        CLIP_BACKEND = backend
+
+def model_tag():
+    # Non-fp32 backends produce slightly different vectors, so they get their own tag
+    tag = "%s@%s" % (MODEL_NAME, MODEL_REVISION)
+    return tag if CLIP_BACKEND == "torch" else "%s+%s" % (tag, CLIP_BACKEND)
+
+def _load_model():
+    import torch
+    from transformers import CLIPModel
+
+    if CLIP_NUM_THREADS > 0:
+        torch.set_num_threads(CLIP_NUM_THREADS)
+    return CLIPModel.from_pretrained(MODEL_NAME, revision=MODEL_REVISION).eval()
+
+def get_processor():
+    global _processor
+    if _processor is None:
+        with _lock:
+            if _processor is None:
+                from transformers import CLIPProcessor
+                _processor = CLIPProcessor.from_pretrained(MODEL_NAME, revision=MODEL_REVISION, use_fast=True)
+    return _processor
+
+def get_clip():
+    # Loads the fp32 CLIP model on first use; every caller in the process shares the same copy
+    global _clip
+    if _clip is None:
+        with _lock:
+            if _clip is None:
+                import torch
+
+                t0 = time.time()
+                device = CLIP_DEVICE or ("cuda" if torch.cuda.is_available() else "cpu")
+                model = _load_model().to(device)
+                print("✅ Loaded CLIP %s on %s in %.2f seconds" % (model_tag(), device, time.time() - t0))
+                _clip = (model, get_processor())
+    return _clip
+
+def embed_dim():
+    global _config
+    if _config is None:
+        from transformers import CLIPConfig
+        _config = CLIPConfig.from_pretrained(MODEL_NAME, revision=MODEL_REVISION)
+    return _config.projection_dim
+
+class TorchImageEncoder:
+    def __init__(self, model, device):
+        self.model = model
+        self.device = device
+
+    def __call__(self, pixel_values):
+        import torch
+
+        with torch.no_grad():
+            inputs = torch.from_numpy(pixel_values).to(self.device)
+            return self.model.get_image_features(pixel_values=inputs).cpu().numpy()
+
+class OnnxImageEncoder:
+    def __init__(self, path):
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        if CLIP_NUM_THREADS > 0:
+            opts.intra_op_num_threads = CLIP_NUM_THREADS
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+
+    def __call__(self, pixel_values):
+        return self.session.run(None, {"pixel_values": pixel_values})[0]
+
+def export_onnx(path=None):
+    import torch
+
+    path = path or CLIP_ONNX_PATH
+    model = _load_model()
+
+    class ImageFeatures(torch.nn.Module):
+        def __init__(self, clip):
+            super().__init__()
+            self.clip = clip
+
+        def forward(self, pixel_values):
+            return self.clip.get_image_features(pixel_values=pixel_values)
+
+    size = model.config.vision_config.image_size
+    torch.onnx.export(
+        ImageFeatures(model),
+        torch.zeros(1, 3, size, size),
+        path,
+        input_names=["pixel_values"],
+        output_names=["image_embeds"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+        opset_version=17
+    )
+    print("✅ Exported CLIP image encoder to %s" % path)
+    return path
+
+def get_image_encoder():
+    global _encoder
+    if _encoder is None:
+        with _lock:
+            if _encoder is None:
+                t0 = time.time()
+                if CLIP_BACKEND == "torch":
+                    model, _ = get_clip()
+                    _encoder = TorchImageEncoder(model, model.device)
+                elif CLIP_BACKEND == "torch-int8":
+                    import torch
+                    model = torch.ao.quantization.quantize_dynamic(_load_model(), {torch.nn.Linear}, dtype=torch.qint8)
+                    _encoder = TorchImageEncoder(model, "cpu")
+                elif CLIP_BACKEND == "onnx":
+                    if not os.path.exists(CLIP_ONNX_PATH):
+                        export_onnx(CLIP_ONNX_PATH)
+                    _encoder = OnnxImageEncoder(CLIP_ONNX_PATH)
+                else:
+                    raise ValueError("unknown CLIP backend %r, expected one of %s" % (CLIP_BACKEND, BACKENDS))
+                print("✅ Ready CLIP image encoder (%s) in %.2f seconds" % (CLIP_BACKEND, time.time() - t0))
+    return _encoder
+
+def encode_pil_images(images):
+    # One forward pass over a list of PIL images -> (N, dim) float32, L2-normalized
+    # The fast image processor only returns PyTorch tensors
+    pixel_values = get_processor()(images=images, return_tensors="pt")["pixel_values"].numpy().astype(np.float32)
+    emb = np.asarray(get_image_encoder()(pixel_values), dtype=np.float32)
+    return emb / np.linalg.norm(emb, axis=1, keepdims=True)
@@ -0,0 +1,133 @@
+# db.py
+#
+# Central Postgres config and one thread-safe connection pool shared by every
+# module. Borrow a connection for the duration of a unit of work:
+#
+#   with get_conn() as conn:
+#       with conn.cursor() as cur:
+#           cur.execute(...)
+#
+# The transaction is committed when the block exits cleanly and rolled back
+# on error; broken connections are discarded instead of returned to the pool.
+# Every pooled connection has the pgvector adapter registered, so NumPy arrays
+# bind directly as vector parameters and vector columns come back as float32
+# arrays.
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from pgvector.psycopg2 import register_vector
+
+DB = {
+    "host": os.environ.get("PGHOST", "localhost"),
+    "port": int(os.environ.get("PGPORT", 5432)),
+    "dbname": os.environ.get("PGDATABASE", "mydb"),
+    "user": os.environ.get("PGUSER", "postgres"),
+    "password": os.environ.get("PGPASSWORD", "mypassword"),
+}
+
+POOL_MIN = int(os.environ.get("DB_POOL_MIN", 1))
+POOL_MAX = int(os.environ.get("DB_POOL_MAX", 10))
+# Connections idle longer than this are pinged before being handed out
+HEALTH_CHECK_IDLE_SECONDS = float(os.environ.get("DB_HEALTH_CHECK_IDLE_SECONDS", 30))
+# How long a caller waits for a free connection before giving up
+POOL_TIMEOUT_SECONDS = float(os.environ.get("DB_POOL_TIMEOUT_SECONDS", 30))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises instead of blocking when exhausted, so callers
+# queue on a semaphore sized to the pool
+_slots = threading.BoundedSemaphore(POOL_MAX)
+_last_used = {}
+
+class VectorConnectionPool(ThreadedConnectionPool):
+    def _connect(self, key=None):
+        conn = super()._connect(key)
+        register_vector_types(conn)
+        return conn
+
+def register_vector_types(conn):
+    # Needs the vector extension; connections opened before it exists (e.g. on
+    # a fresh database) simply skip registration
+    try:
+        register_vector(conn)
+    except psycopg2.ProgrammingError as e:
+        print(f"⚠️ pgvector types not registered: {e}")
+    conn.rollback()
+
+def get_pool():
+    global _pool, _pool_pid, _last_used
+    # A pool inherited through fork shares sockets with the parent; start fresh
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = VectorConnectionPool(POOL_MIN, POOL_MAX, **DB)
+                _pool_pid = os.getpid()
+                _last_used = {}
+    return _pool
+
+def _healthy(conn):
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0) < HEALTH_CHECK_IDLE_SECONDS:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def _checkout(pool):
+    # Replace dead connections (server restart, idle timeout) transparently
+    for _ in range(POOL_MAX + 1):
+        conn = pool.getconn()
+        if _healthy(conn):
+            return conn
+        _last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
+    raise psycopg2.OperationalError("❌ Could not get a healthy database connection from the pool")
+
+@contextmanager
+def get_conn():
+    if not _slots.acquire(timeout=POOL_TIMEOUT_SECONDS):
+        raise PoolError(f"❌ No database connection free after {POOL_TIMEOUT_SECONDS}s")
+    pool = None
+    conn = None
+    broken = False
+    try:
+        pool = get_pool()
+        conn = _checkout(pool)
+        yield conn
+        conn.commit()
+    except BaseException as e:
+        broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        if conn is not None and not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        raise
+    finally:
+        if conn is not None:
+            broken = broken or conn.closed or \
+                conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE
+            if broken:
+                _last_used.pop(id(conn), None)
+            else:
+                _last_used[id(conn)] = time.monotonic()
+            pool.putconn(conn, close=broken)
+        _slots.release()
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
@@ -1,30 +1,269 @@
 # embedding_cache.py
 
-from transformers import CLIPProcessor, CLIPModel
 from PIL import Image
-import torch
+from collections import OrderedDict
+from concurrent.futures import Future
+from clip_provider import encode_pil_images, embed_dim, model_tag
+import numpy as np
 import base64
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+import time
 from io import BytesIO
 
-clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
+# Max images per CLIP forward pass, and how long the micro-batcher waits for
+# more concurrent requests before running a batch (0 disables micro-batching)
+BATCH_SIZE = int(os.environ.get("CLIP_BATCH_SIZE", 32))
+BATCH_WINDOW_MS = float(os.environ.get("CLIP_BATCH_WINDOW_MS", 5))
 
-clip_processor = CLIPProcessor.from_pretrained(
-    "openai/clip-vit-base-patch32",
-    use_fast=True
-)
-clip_model.eval().to("cuda" if torch.cuda.is_available() else "cpu")
+# In-memory LRU budget and on-disk cache location ("" disables the disk tier)
+CACHE_MAX_BYTES = int(os.environ.get("EMBEDDING_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite")
 
-cache = {}
+def image_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+class EmbeddingCache:
+    # Two tiers keyed by a digest of the decoded image bytes: a byte-bounded
+    # LRU in memory, backed by a SQLite file that survives restarts.
+
+    def __init__(self, model_tag, max_bytes=CACHE_MAX_BYTES, path=CACHE_PATH):
+        # model_tag may be a callable so a backend chosen via configure() is honoured
+        self.model_tag = model_tag
+        self.max_bytes = max_bytes
+        self._lru = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (model, digest)
+                )
+            """)
+            self._db.commit()
+
+    def _tag(self):
+        return self.model_tag() if callable(self.model_tag) else self.model_tag
+
+    def _remember(self, digest, vec):
+        # Caller holds the lock
+        if digest in self._lru:
+            self._lru.move_to_end(digest)
+            return
+        self._lru[digest] = vec
+        self._bytes += vec.nbytes + len(digest)
+        while self._bytes > self.max_bytes and self._lru:
+            old_digest, old_vec = self._lru.popitem(last=False)
+            self._bytes -= old_vec.nbytes + len(old_digest)
+            self.stats["evictions"] += 1
+
+    def get_many(self, digests):
+        found = {}
+        with self._lock:
+            for d in digests:
+                if d in self._lru:
+                    self._lru.move_to_end(d)
+                    found[d] = self._lru[d]
+                    self.stats["memory_hits"] += 1
+
+            missing = [d for d in dict.fromkeys(digests) if d not in found]
+            if missing and self._db is not None:
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start:start + 500]
+                    rows = self._db.execute(
+                        "SELECT digest, vector FROM embeddings WHERE model = ? AND digest IN (%s)"
+                        % ",".join("?" * len(chunk)),
+                        [self._tag()] + chunk
+                    ).fetchall()
+                    for d, blob in rows:
+                        vec = np.frombuffer(blob, dtype=np.float32).copy()
+                        found[d] = vec
+                        self._remember(d, vec)
+                        self.stats["disk_hits"] += 1
+
+            self.stats["misses"] += sum(1 for d in digests if d not in found)
+        return found
+
+    def get(self, digest):
+        return self.get_many([digest]).get(digest)
+
+    def put_many(self, items):
+        with self._lock:
+            for d, vec in items.items():
+                self._remember(d, vec)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, digest, vector) VALUES (?, ?, ?)",
+                    [(self._tag(), d, np.asarray(vec, dtype=np.float32).tobytes()) for d, vec in items.items()]
+                )
+                self._db.commit()
+
+    def put(self, digest, vec):
+        self.put_many({digest: vec})
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._lru), bytes=self._bytes, max_bytes=self.max_bytes)
+
+# Cached vectors are only valid for the model that produced them
+cache = EmbeddingCache(model_tag)
+
+def cache_stats():
+    return cache.info()
+
+def parse_embedding(value):
+    # Stored vectors arrive as float32 arrays from the pgvector adapter, or as
+    # pgvector text ("[0.1,0.2,...]") / lists from older paths;
+    # None/NaN mean "no embedding"
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, str):
+        return np.array(value.strip("[]").split(","), dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+def _to_bytes(img):
+    # Accepts a base64 string or raw image bytes
+    if isinstance(img, str):
+        return base64.b64decode(img)
+    if isinstance(img, (bytes, bytearray, memoryview)):
+        return bytes(img)
+    raise TypeError("expected base64 str or bytes, got %s" % type(img).__name__)
+
+def _to_image(img):
+    return Image.open(BytesIO(_to_bytes(img))).convert("RGB")
+
+def encode_images_batch(images, batch_size=BATCH_SIZE, skip_invalid=False, return_mask=False):
+    # With skip_invalid, missing or undecodable images get an all-zero row
+    # instead of raising; return_mask also returns which rows were encoded.
+    raw = []
+    for img in images:
+        try:
+            raw.append(_to_bytes(img))
+        except Exception:
+            if not skip_invalid:
+                raise
+            raw.append(None)
+    digests = [image_digest(data) if data is not None else None for data in raw]
+    found = cache.get_many([d for d in digests if d is not None])
+
+    # Encode each missing image once, even if it appears several times
+    todo = {}
+    for i, d in enumerate(digests):
+        if d is not None and d not in found and d not in todo:
+            todo[d] = i
+    todo = list(todo.items())
+
+    for start in range(0, len(todo), batch_size):
+        chunk, pil_images = [], []
+        for d, i in todo[start:start + batch_size]:
+            try:
+                pil_images.append(_to_image(raw[i]))
+                chunk.append(d)
+            except Exception:
+                if not skip_invalid:
+                    raise
+        if not chunk:
+            continue
+        encoded = dict(zip(chunk, encode_pil_images(pil_images)))
+        cache.put_many(encoded)
+        found.update(encoded)
+
+    # Fully cached batches never need the model loaded
+    dim = len(next(iter(found.values()))) if found else embed_dim()
+    out = np.zeros((len(images), dim), dtype=np.float32)
+    valid = np.zeros(len(images), dtype=bool)
+    for i, d in enumerate(digests):
+        if d in found:
+            out[i] = found[d]
+            valid[i] = True
+    return (out, valid) if return_mask else out
+
+class MicroBatcher:
+    # Gathers single-image requests arriving concurrently (e.g. from several
+    # Streamlit sessions) and runs them through CLIP as one forward pass.
+
+    def __init__(self, max_batch_size=BATCH_SIZE, window_ms=BATCH_WINDOW_MS):
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="clip-microbatcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, img) -> Future:
+        self._ensure_started()
+        fut = Future()
+        self._queue.put((img, fut))
+        return fut
+
+    def encode(self, img):
+        return self.submit(img).result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+
+            # Decode one by one so a bad upload only fails its own request
+            images, futures = [], []
+            for img, fut in batch:
+                try:
+                    images.append(_to_image(img))
+                    futures.append(fut)
+                except Exception as e:
+                    fut.set_exception(e)
+            if not images:
+                continue
+
+            try:
+                vecs = encode_pil_images(images)
+            except Exception as e:
+                for fut in futures:
+                    fut.set_exception(e)
+                continue
+            for fut, vec in zip(futures, vecs):
+                fut.set_result(vec)
+
+micro_batcher = MicroBatcher()
 
 def encode_image_b64_to_vector(b64_img):
-    if b64_img in cache:
-        return cache[b64_img]
-
-    image = Image.open(BytesIO(base64.b64decode(b64_img))).convert("RGB")
-    inputs = clip_processor(images=image, return_tensors="pt").to(clip_model.device)
-    with torch.no_grad():
-        emb = clip_model.get_image_features(**inputs)[0]
-        emb = emb / emb.norm()
-    vec = emb.cpu().numpy().tolist()
-    cache[b64_img] = vec
-    return vec
+    data = base64.b64decode(b64_img)
+    digest = image_digest(data)
+    emb = cache.get(digest)
+    if emb is not None:
+        return emb
+
+    if BATCH_WINDOW_MS > 0:
+        emb = micro_batcher.encode(data)
+    else:
+        emb = encode_pil_images([_to_image(data)])[0]
+    cache.put(digest, emb)
+    return emb
@@ -1,46 +1,94 @@
 import pandas as pd
 import numpy as np
 from rapidfuzz.fuzz import partial_ratio
-from sklearn.metrics.pairwise import cosine_similarity
-from transformers import CLIPProcessor, CLIPModel
-from PIL import Image
-from io import BytesIO
-import base64
-import torch
+from embedding_cache import encode_images_batch, parse_embedding
+from similarity import paired_partial_ratio, paired_cosine
 
-# Load CLIP once
-clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32", use_fast=True)
+# Bump when the meaning or order of the feature columns changes, so stored
+# feature tables built by an older version are rebuilt instead of reused
+FEATURE_VERSION = 1
+FEATURE_COLUMNS = ['first_name_sim', 'last_name_sim', 'birthdate_match', 'email_match', 'mdm_match', 'image_sim']
 
 def text_similarity(a: str, b: str) -> float:
     return partial_ratio(str(a).lower(), str(b).lower()) / 100.0
 
 def b64_to_clip_embedding(b64: str):
-    try:
-        image = Image.open(BytesIO(base64.b64decode(b64))).convert("RGB")
-        inputs = clip_processor(images=image, return_tensors="pt")
-        with torch.no_grad():
-            features = clip_model.get_image_features(**inputs)
-        return features[0].numpy()
-    except Exception:
-        return np.zeros(512)  # fallback for invalid image
+    return b64_list_to_clip_embeddings([b64])[0]
+
+def b64_list_to_clip_embeddings(b64s):
+    # Zero rows for missing/invalid images
+    return encode_images_batch(list(b64s), skip_invalid=True)
+
+def stored_embeddings(df: pd.DataFrame, side: str):
+    # Precomputed vectors in '<side>_embedding' (e.g. face_embedding from
+    # people_with_faces or the query vector from embedding_cache). Returns the
+    # (N, 512) float32 matrix and a mask of rows that have one.
+    out = np.zeros((len(df), 512), dtype=np.float32)
+    valid = np.zeros(len(df), dtype=bool)
+
+    emb_col = f"{side}_embedding"
+    if emb_col in df.columns:
+        for i, value in enumerate(df[emb_col]):
+            vec = parse_embedding(value)
+            if vec is not None:
+                out[i] = vec
+                valid[i] = True
+    return out, valid
+
+def encode_unique_images(payloads):
+    # Hash the image payloads, run each distinct image through CLIP once and
+    # scatter the vectors back to every row that carries it
+    codes, uniques = pd.factorize(pd.Series(list(payloads), dtype=object))
+    out = np.zeros((len(codes), 512), dtype=np.float32)
+    valid = np.zeros(len(codes), dtype=bool)
+
+    if len(uniques):
+        vecs, ok = encode_images_batch(list(uniques), skip_invalid=True, return_mask=True)
+        has = codes >= 0
+        out[has] = vecs[codes[has]]
+        valid[has] = ok[codes[has]]
+    return out, valid
+
+def pair_embeddings(df: pd.DataFrame):
+    # Embeddings for both sides of every pair; only rows without a stored
+    # vector are encoded, and an image shared across rows or sides is encoded once
+    a_emb, a_valid = stored_embeddings(df, 'a')
+    b_emb, b_valid = stored_embeddings(df, 'b')
+
+    a_need = np.flatnonzero(~a_valid) if 'a_img' in df.columns else np.array([], dtype=int)
+    b_need = np.flatnonzero(~b_valid) if 'b_img' in df.columns else np.array([], dtype=int)
+    if len(a_need) or len(b_need):
+        payloads = []
+        if len(a_need):
+            payloads += df['a_img'].iloc[a_need].tolist()
+        if len(b_need):
+            payloads += df['b_img'].iloc[b_need].tolist()
+        vecs, ok = encode_unique_images(payloads)
+        a_emb[a_need], a_valid[a_need] = vecs[:len(a_need)], ok[:len(a_need)]
+        b_emb[b_need], b_valid[b_need] = vecs[len(a_need):], ok[len(a_need):]
+
+    return a_emb, a_valid, b_emb, b_valid
+
+def feature_arrays(df: pd.DataFrame):
+    # One NumPy array per feature, keyed in FEATURE_COLUMNS order
+    a_embeddings, a_valid, b_embeddings, b_valid = pair_embeddings(df)
+    return {
+        'first_name_sim': paired_partial_ratio(df['a_first'], df['b_first']),
+        'last_name_sim': paired_partial_ratio(df['a_last'], df['b_last']),
+        'birthdate_match': (df['a_birth'] == df['b_birth']).to_numpy(dtype=int),
+        'email_match': (df['a_email'].str.lower() == df['b_email'].str.lower()).to_numpy(dtype=int),
+        'mdm_match': (df['a_mdm'] == df['b_mdm']).to_numpy(dtype=int),
+        # Image similarity via CLIP
+        'image_sim': paired_cosine(a_embeddings, b_embeddings, a_valid & b_valid),
+    }
+
+def extract_feature_matrix(df: pd.DataFrame) -> np.ndarray:
+    # (N, len(FEATURE_COLUMNS)) float32 matrix for the low-latency scoring path
+    arrays = feature_arrays(df)
+    return np.column_stack([arrays[col] for col in FEATURE_COLUMNS]).astype(np.float32)
 
 def extract_features(df: pd.DataFrame):
-    features = pd.DataFrame()
-
-    features['first_name_sim'] = [text_similarity(a, b) for a, b in zip(df['a_first'], df['b_first'])]
-    features['last_name_sim'] = [text_similarity(a, b) for a, b in zip(df['a_last'], df['b_last'])]
-    features['birthdate_match'] = (df['a_birth'] == df['b_birth']).astype(int)
-    features['email_match'] = (df['a_email'].str.lower() == df['b_email'].str.lower()).astype(int)
-    features['mdm_match'] = (df['a_mdm'] == df['b_mdm']).astype(int)
-
-    # Image similarity via CLIP
-    a_embeddings = [b64_to_clip_embedding(b64) for b64 in df['a_img']]
-    b_embeddings = [b64_to_clip_embedding(b64) for b64 in df['b_img']]
-    features['image_sim'] = [
-        cosine_similarity([a], [b])[0][0] if np.any(a) and np.any(b) else 0.0
-        for a, b in zip(a_embeddings, b_embeddings)
-    ]
+    features = pd.DataFrame(feature_arrays(df), columns=FEATURE_COLUMNS)
 
     # Return with optional target
     target = df['match'].astype(int) if 'match' in df.columns else None
@@ -0,0 +1,116 @@
+# feature_store.py
+#
+# Streams training pairs in chunks, extracts features across a process pool
+# and writes them to a compact Parquet file (features + label + pair ids +
+# feature version), so models can be retrained without touching CLIP again.
+
+import os
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from extract_features import extract_features, FEATURE_VERSION, FEATURE_COLUMNS
+from image_store import ImageStore, IMAGE_STORE_PATH
+
+# Compact pairs (image refs, see image_store) or the legacy inlined-image CSV
+PAIRS_PATH = "training_pairs.parquet"
+FEATURE_STORE_PATH = "training_features.parquet"
+CHUNK_SIZE = 2000
+
+_image_store = None
+
+def _init_worker(num_threads, image_store_path=IMAGE_STORE_PATH):
+    # Split the cores between workers instead of every worker using all of them
+    import clip_provider
+    clip_provider.configure(num_threads=num_threads)
+
+    global _image_store
+    _image_store = ImageStore(image_store_path)
+
+def materialize_images(chunk: pd.DataFrame, image_store: ImageStore) -> pd.DataFrame:
+    # Turn a_img_ref/b_img_ref into image bytes just before feature extraction
+    if 'a_img_ref' not in chunk.columns:
+        return chunk
+    images = image_store.materialize(chunk['a_img_ref'].tolist() + chunk['b_img_ref'].tolist())
+    chunk = chunk.copy()
+    chunk['a_img'] = pd.Series(images[:len(chunk)], index=chunk.index, dtype=object)
+    chunk['b_img'] = pd.Series(images[len(chunk):], index=chunk.index, dtype=object)
+    return chunk
+
+def _extract_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    chunk = materialize_images(chunk.reset_index(drop=True), _image_store)
+    X, y = extract_features(chunk)
+    out = X[FEATURE_COLUMNS].copy()
+    out['label'] = y.to_numpy() if y is not None else -1
+    out['a_id'] = chunk['a_id'].to_numpy()
+    out['b_id'] = chunk['b_id'].to_numpy()
+    out['feature_version'] = FEATURE_VERSION
+    return out
+
+def read_pair_chunks(pairs_path=PAIRS_PATH, chunksize=CHUNK_SIZE):
+    if pairs_path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        return (batch.to_pandas() for batch in pq.ParquetFile(pairs_path).iter_batches(batch_size=chunksize))
+    return pd.read_csv(pairs_path, chunksize=chunksize)
+
+def build_feature_store(pairs_path=PAIRS_PATH, out_path=FEATURE_STORE_PATH, chunksize=CHUNK_SIZE, workers=None,
+                        image_store_path=IMAGE_STORE_PATH):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    workers = workers or os.cpu_count() or 1
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    tmp_path = out_path + ".tmp"
+    start_time = time.time()
+
+    writer = None
+    rows = 0
+    # spawn, not fork: the parent holds an open SQLite handle for the embedding cache
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker, initargs=(threads, image_store_path)) as pool:
+        pending = deque()
+        chunks = iter(read_pair_chunks(pairs_path, chunksize))
+
+        def submit_next():
+            chunk = next(chunks, None)
+            if chunk is not None:
+                pending.append(pool.submit(_extract_chunk, chunk))
+
+        # Keep a bounded number of chunks in flight so memory stays flat
+        for _ in range(workers * 2):
+            submit_next()
+
+        while pending:
+            part = pending.popleft().result()
+            submit_next()
+
+            table = pa.Table.from_pandas(part, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema, compression="zstd")
+            writer.write_table(table.cast(writer.schema))
+            rows += len(part)
+            print("✅ Extracted features for %s pairs (%.1f s)" % (rows, time.time() - start_time))
+
+    if writer is None:
+        raise ValueError(f"No training pairs found in {pairs_path}")
+    writer.close()
+    os.replace(tmp_path, out_path)
+    print("✅ Wrote %s rows to %s in %.1f seconds" % (rows, out_path, time.time() - start_time))
+    return out_path
+
+def load_feature_store(path=FEATURE_STORE_PATH):
+    df = pd.read_parquet(path)
+    versions = set(df['feature_version'].unique())
+    if versions != {FEATURE_VERSION}:
+        raise ValueError(f"{path} has feature version(s) {sorted(versions)}, expected {FEATURE_VERSION}; rebuild it")
+    return df[FEATURE_COLUMNS], df['label'].astype(int)
+
+def load_or_build_features(pairs_path=PAIRS_PATH, store_path=FEATURE_STORE_PATH, rebuild=False, **kwargs):
+    if not rebuild and os.path.exists(store_path):
+        try:
+            return load_feature_store(store_path)
+        except ValueError as e:
+            print(f"⚠️ {e}")
+    build_feature_store(pairs_path, store_path, **kwargs)
+    return load_feature_store(store_path)
@@ -1,154 +1,244 @@
-import psycopg2
+import argparse
+import os
 import pandas as pd
+import numpy as np
 import random
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
 from io import BytesIO
 from PIL import Image, ImageOps
 import base64
+from image_store import make_ref, write_image_store, IMAGE_STORE_PATH
+from db import get_conn
 
-DB = {
-    "host": "localhost",
-    "port": 5432,
-    "dbname": "mydb",
-    "user": "postgres",
-    "password": "mypassword"
-}
+OUTPUT_PATH = "training_pairs.parquet"
+INLINE_OUTPUT_PATH = "training_pairs_expanded.csv"
+CHUNK_SIZE = 500
 
 def fetch_data():
-    conn = psycopg2.connect(**DB)
-    people = pd.read_sql("SELECT id, person_id, first_nm, last_nm, birth_dt, mdm_person_id, email_address, headshot_b64 FROM people_with_faces", conn)
-    nick_df = pd.read_sql("SELECT nickname, canonical FROM nicknames", conn)
-    conn.close()
+    with get_conn() as conn:
+        people = pd.read_sql("SELECT id, person_id, first_nm, last_nm, birth_dt, mdm_person_id, email_address, headshot_b64 FROM people_with_faces", conn)
+        nick_df = pd.read_sql("SELECT nickname, canonical FROM nicknames", conn)
     nickname_map = {n.lower(): c.lower() for n, c in nick_df.to_records(index=False)}
     return people, nickname_map
 
-def flip_img_b64(b64):
-    img = Image.open(BytesIO(base64.b64decode(b64)))
-    img = ImageOps.mirror(img)
+def decode_img_b64(b64):
+    return Image.open(BytesIO(base64.b64decode(b64)))
+
+def encode_img_b64(img):
     buf = BytesIO()
     img.save(buf, format="PNG")
     return base64.b64encode(buf.getvalue()).decode("utf-8")
 
+def flip_img_b64(b64):
+    return encode_img_b64(ImageOps.mirror(decode_img_b64(b64)))
+
 def rotate_img_b64(b64, angle=15):
-    img = Image.open(BytesIO(base64.b64decode(b64)))
-    img = img.rotate(angle, expand=True)
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    return base64.b64encode(buf.getvalue()).decode("utf-8")
+    return encode_img_b64(decode_img_b64(b64).rotate(angle, expand=True))
 
 def rotate_180_b64(b64, angle=180):
-    img = Image.open(BytesIO(base64.b64decode(b64)))
-    img = img.rotate(angle, expand=True)
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    return base64.b64encode(buf.getvalue()).decode("utf-8")
+    return rotate_img_b64(b64, angle)
 
-def generate_training_data(df, nickname_map):
-    pairs = []
+def augment_headshot(b64, angle):
+    # Decode once and derive every augmented variant from the same image
+    img = decode_img_b64(b64)
+    img.load()
+    return {
+        'flip': encode_img_b64(ImageOps.mirror(img)),
+        'rotated': encode_img_b64(img.rotate(angle, expand=True)),
+        'rotated_180': encode_img_b64(img.rotate(180, expand=True)),
+    }
 
-    for _, row in df.iterrows():
-        base_id = row['person_id']
-        base_fn = row['first_nm']
-        base_ln = row['last_nm']
-        base_email = row['email_address']
-        # base_domain = base_email.split('@')[-1]
-        base_mdm = row['mdm_person_id']
-        base_bd = pd.to_datetime(row['birth_dt'])
+def headshot_refs(person_id, angle):
+    # Compact format: point at the stored headshot plus an augmentation op
+    return {
+        'flip': make_ref(person_id, 'flip'),
+        'rotated': make_ref(person_id, f'rotate:{angle}'),
+        'rotated_180': make_ref(person_id, 'rotate:180'),
+    }
+
+def positive_pairs_for(row, nickname_map, rng, inline_images=True):
+    base_id = row['person_id']
+    base_fn = row['first_nm']
+    base_ln = row['last_nm']
+    base_email = row['email_address']
+    # base_domain = base_email.split('@')[-1]
+    base_mdm = row['mdm_person_id']
+    base_bd = pd.to_datetime(row['birth_dt'])
+    angle = rng.choice([10, -10, 15])
+    if inline_images:
         base_img = row['headshot_b64']
-        
-        def record_variation(b_id, b_fn, b_ln, b_email, b_bd, b_img, b_type):
-            return {
-                'a_id': base_id,
-                'b_id': b_id,
-                'a_first': base_fn,
-                'b_first': b_fn,
-                'a_last': base_ln,
-                'b_last': b_ln,
-                'a_birth': base_bd.strftime('%Y-%m-%d'),
-                'b_birth': b_bd.strftime('%Y-%m-%d'),
-                'a_email': base_email,
-                'b_email': b_email,
-                'a_mdm': base_mdm,
-                'b_mdm': base_mdm,
-                'a_img': base_img,
-                'b_img': b_img,
-                'match': 1,
-                'type': b_type
-            }
-
-        # Variant 1: minor changes
-        pairs.append(record_variation(
-            base_id + 10, base_fn.lower(), base_ln.upper(),
-            base_email, base_bd + timedelta(days=random.randint(-300, 300)),
-            flip_img_b64(base_img), 'standard'
-        ))
+        variants = augment_headshot(base_img, angle)
+    else:
+        base_img = make_ref(base_id) if row['headshot_b64'] else None
+        variants = headshot_refs(base_id, angle)
+    img_a, img_b = ('a_img', 'b_img') if inline_images else ('a_img_ref', 'b_img_ref')
 
-        # Variant 2: missing image
-        pairs.append(record_variation(
-            base_id + 20, base_fn, base_ln,
-            base_email, base_bd, None, 'missing_img'
-        ))
+    def record_variation(b_id, b_fn, b_ln, b_email, b_bd, b_img, b_type):
+        return {
+            'a_id': base_id,
+            'b_id': b_id,
+            'a_first': base_fn,
+            'b_first': b_fn,
+            'a_last': base_ln,
+            'b_last': b_ln,
+            'a_birth': base_bd.strftime('%Y-%m-%d'),
+            'b_birth': b_bd.strftime('%Y-%m-%d'),
+            'a_email': base_email,
+            'b_email': b_email,
+            'a_mdm': base_mdm,
+            'b_mdm': base_mdm,
+            img_a: base_img,
+            img_b: b_img,
+            'match': 1,
+            'type': b_type
+        }
 
-        # Variant 3: nickname
-        canon = nickname_map.get(base_fn.lower())
-        if canon and canon != base_fn.lower():
-            pairs.append(record_variation(
-                base_id + 30, canon, base_ln,
-                base_email, base_bd, base_img, 'nickname'
-            ))
+    pairs = []
 
-        # Variant 4: name hybrid
-        hybrid_fn = f"{base_fn}-{canon or base_fn}"
-        pairs.append(record_variation(
-            base_id + 40, hybrid_fn, base_ln,
-            base_email, base_bd, base_img, 'hybrid'
-        ))
-        
-        # Variant 5: rotated image
-        pairs.append(record_variation(
-            base_id + 50, base_fn, base_ln,
-            base_email, base_bd, rotate_img_b64(base_img, angle=random.choice([10, -10, 15])), 'rotated'
-        ))
-        
-        # Variant 6: rotated image 180 degrees
+    # Variant 1: minor changes
+    pairs.append(record_variation(
+        base_id + 10, base_fn.lower(), base_ln.upper(),
+        base_email, base_bd + timedelta(days=rng.randint(-300, 300)),
+        variants['flip'], 'standard'
+    ))
+
+    # Variant 2: missing image
+    pairs.append(record_variation(
+        base_id + 20, base_fn, base_ln,
+        base_email, base_bd, None, 'missing_img'
+    ))
+
+    # Variant 3: nickname
+    canon = nickname_map.get(base_fn.lower())
+    if canon and canon != base_fn.lower():
         pairs.append(record_variation(
-            base_id + 60, base_fn, base_ln,
-            base_email, base_bd, rotate_180_b64(base_img), 'rotated_180'
+            base_id + 30, canon, base_ln,
+            base_email, base_bd, base_img, 'nickname'
         ))
-        
+
+    # Variant 4: name hybrid
+    hybrid_fn = f"{base_fn}-{canon or base_fn}"
+    pairs.append(record_variation(
+        base_id + 40, hybrid_fn, base_ln,
+        base_email, base_bd, base_img, 'hybrid'
+    ))
+
+    # Variant 5: rotated image
+    pairs.append(record_variation(
+        base_id + 50, base_fn, base_ln,
+        base_email, base_bd, variants['rotated'], 'rotated'
+    ))
+
+    # Variant 6: rotated image 180 degrees
+    pairs.append(record_variation(
+        base_id + 60, base_fn, base_ln,
+        base_email, base_bd, variants['rotated_180'], 'rotated_180'
+    ))
+
+    return pairs
+
+_nickname_map = {}
+
+def _init_worker(nickname_map):
+    global _nickname_map
+    _nickname_map = nickname_map
+
+def _positive_pairs_chunk(args):
+    records, seed, inline_images = args
+    rng = random.Random(seed)
+    pairs = []
+    for row in records:
+        pairs.extend(positive_pairs_for(row, _nickname_map, rng, inline_images))
+    return pairs
+
+def _iso_dates(values):
+    return pd.to_datetime(values).dt.strftime('%Y-%m-%d').to_numpy()
+
+def negative_pairs(df, rng=None, inline_images=True):
+    # Pair every person with a random other person via one shuffled index
+    rng = rng or np.random.default_rng()
+    perm = rng.permutation(len(df))
+    a = df.reset_index(drop=True)
+    b = a.iloc[perm].reset_index(drop=True)
+    keep = (a['person_id'] != b['person_id']).to_numpy()
+    a, b = a[keep], b[keep]
+
+    if inline_images:
+        images = {'a_img': a['headshot_b64'].to_numpy(), 'b_img': b['headshot_b64'].to_numpy()}
+    else:
+        images = {
+            'a_img_ref': [make_ref(pid) if img else None for pid, img in zip(a['person_id'], a['headshot_b64'])],
+            'b_img_ref': [make_ref(pid) if img else None for pid, img in zip(b['person_id'], b['headshot_b64'])],
+        }
+
+    return pd.DataFrame({
+        'a_id': a['person_id'].to_numpy(),
+        'b_id': b['person_id'].to_numpy(),
+        'a_first': a['first_nm'].to_numpy(),
+        'b_first': b['first_nm'].to_numpy(),
+        'a_last': a['last_nm'].to_numpy(),
+        'b_last': b['last_nm'].to_numpy(),
+        'a_birth': _iso_dates(a['birth_dt']),
+        'b_birth': _iso_dates(b['birth_dt']),
+        'a_email': a['email_address'].to_numpy(),
+        'b_email': b['email_address'].to_numpy(),
+        # 'a_domain': row1['email_address'].split('@')[-1],
+        # 'b_domain': row2['email_address'].split('@')[-1],
+        'a_mdm': a['mdm_person_id'].to_numpy(),
+        'b_mdm': b['mdm_person_id'].to_numpy(),
+        **images,
+        'match': 0,
+        'type': 'random'
+    })
+
+def generate_training_data(df, nickname_map, workers=None, chunksize=CHUNK_SIZE, inline_images=True):
+    # inline_images=False emits image references (see image_store) instead of base64 payloads
+    cols = df.columns if inline_images else [c for c in df.columns if c != 'headshot_b64']
+    records = df[cols].to_dict('records')
+    if not inline_images:
+        has_img = df['headshot_b64'].notna().to_numpy()
+        for rec, flag in zip(records, has_img):
+            rec['headshot_b64'] = bool(flag)
+    chunks = [
+        (records[start:start + chunksize], random.randrange(2 ** 32), inline_images)
+        for start in range(0, len(records), chunksize)
+    ]
+
+    # Augmentation is CPU-bound image work, so fan people out across processes
+    pairs = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker, initargs=(nickname_map,)) as pool:
+        for chunk_pairs in pool.map(_positive_pairs_chunk, chunks):
+            pairs.extend(chunk_pairs)
 
     # Negatives
-    shuffled = df.sample(frac=1).reset_index(drop=True)
-    for i in range(len(df)):
-        row1 = df.iloc[i]
-        row2 = shuffled.iloc[i]
-        if row1['person_id'] != row2['person_id']:
-            pairs.append({
-                'a_id': row1['person_id'],
-                'b_id': row2['person_id'],
-                'a_first': row1['first_nm'],
-                'b_first': row2['first_nm'],
-                'a_last': row1['last_nm'],
-                'b_last': row2['last_nm'],
-                'a_birth': row1['birth_dt'],
-                'b_birth': row2['birth_dt'],
-                'a_email': row1['email_address'],
-                'b_email': row2['email_address'],
-                # 'a_domain': row1['email_address'].split('@')[-1],
-                # 'b_domain': row2['email_address'].split('@')[-1],
-                'a_mdm': row1['mdm_person_id'],
-                'b_mdm': row2['mdm_person_id'],
-                'a_img': row1['headshot_b64'],
-                'b_img': row2['headshot_b64'],
-                'match': 0,
-                'type': 'random'
-            })
-
-    return pd.DataFrame(pairs)
-
-df_people, nickname_map = fetch_data()
-print("✅ Fetched data from database")
-df_pairs = generate_training_data(df_people, nickname_map)
-print("✅ Generated training data")
-df_pairs.to_csv("training_pairs_expanded.csv", index=False)
-print("✅ Saved training_pairs_expanded.csv")
+    negatives = negative_pairs(df, inline_images=inline_images)
+    return pd.concat([pd.DataFrame(pairs), negatives], ignore_index=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic duplicate / non-duplicate training pairs")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--image-store", default=IMAGE_STORE_PATH)
+    parser.add_argument("--inline-images", action="store_true",
+                        help="write the legacy CSV with base64 images inlined in every pair")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    df_people, nickname_map = fetch_data()
+    print("✅ Fetched data from database")
+    df_pairs = generate_training_data(
+        df_people, nickname_map, workers=args.workers, chunksize=args.chunksize,
+        inline_images=args.inline_images
+    )
+    print("✅ Generated training data")
+
+    if args.inline_images:
+        output = args.output or INLINE_OUTPUT_PATH
+        df_pairs.to_csv(output, index=False)
+    else:
+        output = args.output or OUTPUT_PATH
+        n_images = write_image_store(df_people, args.image_store)
+        print(f"✅ Saved {n_images} headshots to {args.image_store}")
+        df_pairs.to_parquet(output, index=False)
+    print(f"✅ Saved {output}")
@@ -0,0 +1,88 @@
+# image_store.py
+#
+# Compact training-pair images: each headshot is stored once (keyed by
+# person_id) and pairs carry small references such as "123", "123|flip",
+# "123|rotate:15" or "123|rotate:180". Images are only decoded/augmented
+# when features are computed.
+
+import base64
+from io import BytesIO
+import pandas as pd
+from PIL import Image, ImageOps
+
+IMAGE_STORE_PATH = "training_images.parquet"
+ROW_GROUP_SIZE = 1000
+
+def make_ref(person_id, op=None):
+    return f"{person_id}|{op}" if op else str(person_id)
+
+def parse_ref(ref):
+    if not isinstance(ref, str) or not ref:
+        return None, None
+    person_id, _, op = ref.partition("|")
+    return int(person_id), op or None
+
+def apply_op(img, op):
+    if op is None:
+        return img
+    if op == "flip":
+        return ImageOps.mirror(img)
+    if op.startswith("rotate:"):
+        return img.rotate(float(op.split(":", 1)[1]), expand=True)
+    raise ValueError(f"Unknown image op {op!r}")
+
+def _png_bytes(img):
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+def write_image_store(people: pd.DataFrame, path=IMAGE_STORE_PATH):
+    # Sorted by person_id with small row groups, so reads filtered by id only
+    # touch the row groups that contain them
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    images = (
+        people[['person_id', 'headshot_b64']]
+        .dropna()
+        .drop_duplicates('person_id')
+        .sort_values('person_id')
+    )
+    pq.write_table(pa.Table.from_pandas(images, preserve_index=False), path, row_group_size=ROW_GROUP_SIZE)
+    return len(images)
+
+class ImageStore:
+    def __init__(self, path=IMAGE_STORE_PATH):
+        self.path = path
+
+    def fetch(self, person_ids):
+        import pyarrow.parquet as pq
+
+        ids = sorted(set(person_ids))
+        if not ids:
+            return {}
+        table = pq.read_table(self.path, columns=['person_id', 'headshot_b64'], filters=[('person_id', 'in', ids)])
+        return dict(zip(table.column('person_id').to_pylist(), table.column('headshot_b64').to_pylist()))
+
+    def materialize(self, refs):
+        # Raw image bytes (or None) for each ref; every distinct ref is built
+        # once and each base headshot is decoded at most once
+        codes, uniques = pd.factorize(pd.Series(list(refs), dtype=object))
+        parsed = [parse_ref(ref) for ref in uniques]
+        bases = self.fetch(pid for pid, _ in parsed if pid is not None)
+
+        decoded = {}
+        built = []
+        for pid, op in parsed:
+            b64 = bases.get(pid)
+            if b64 is None:
+                built.append(None)
+            elif op is None:
+                built.append(base64.b64decode(b64))
+            else:
+                if pid not in decoded:
+                    decoded[pid] = Image.open(BytesIO(base64.b64decode(b64)))
+                    decoded[pid].load()
+                built.append(_png_bytes(apply_op(decoded[pid], op)))
+
+        return [built[c] if c >= 0 else None for c in codes]
@@ -0,0 +1,122 @@
+# model_registry.py
+#
+# Versioned dedup models tracked in model_training_log: every trained model is
+# saved as its own artifact and registered with its feature version and
+# metrics; promoting a version flips the deployed flag, which running
+# scoring processes pick up and hot-swap (see scoring_model).
+
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+import joblib
+from psycopg2.extras import RealDictCursor
+from db import get_conn
+from extract_features import FEATURE_VERSION
+
+MODEL_DIR = "models"
+# Legacy single-file location, kept in sync with the deployed version
+MODEL_OUTPUT = "dedup_model.pkl"
+
+def ensure_registry():
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS model_training_log (
+                id SERIAL PRIMARY KEY,
+                timestamp TIMESTAMP DEFAULT now(),
+                sample_count INT,
+                f1_score FLOAT,
+                deployed BOOLEAN DEFAULT FALSE
+            );
+        """)
+        cur.execute("""
+            ALTER TABLE model_training_log
+                ADD COLUMN IF NOT EXISTS mode TEXT,
+                ADD COLUMN IF NOT EXISTS watermark INT,
+                ADD COLUMN IF NOT EXISTS duration_s FLOAT,
+                ADD COLUMN IF NOT EXISTS artifact_path TEXT,
+                ADD COLUMN IF NOT EXISTS feature_version INT,
+                ADD COLUMN IF NOT EXISTS metrics JSONB;
+        """)
+
+def register_model(model, mode, sample_count, metrics=None, watermark=None, duration_s=None, deploy=False):
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    artifact_path = os.path.join(MODEL_DIR, "dedup_model_%s.pkl" % datetime.now().strftime("%Y%m%d_%H%M%S_%f"))
+    joblib.dump(model, artifact_path)
+
+    metrics = metrics or {}
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO model_training_log
+                (sample_count, f1_score, deployed, mode, watermark, duration_s, artifact_path, feature_version, metrics)
+            VALUES (%s, %s, FALSE, %s, %s, %s, %s, %s, %s)
+            RETURNING id
+        """, (
+            sample_count, metrics.get("f1"), mode, watermark, duration_s,
+            artifact_path, FEATURE_VERSION, json.dumps(metrics)
+        ))
+        version_id = cur.fetchone()[0]
+    print(f"✅ Registered model version {version_id} at {artifact_path}")
+
+    if deploy:
+        promote(version_id)
+    return version_id
+
+def get_version(version_id):
+    with get_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT id, timestamp, artifact_path, feature_version, metrics, deployed
+            FROM model_training_log
+            WHERE id = %s
+        """, (version_id,))
+        row = cur.fetchone()
+    return row
+
+def get_deployed():
+    with get_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT id, timestamp, artifact_path, feature_version, metrics
+            FROM model_training_log
+            WHERE deployed AND artifact_path IS NOT NULL
+            ORDER BY timestamp DESC
+            LIMIT 1
+        """)
+        row = cur.fetchone()
+    return row
+
+def list_versions():
+    with get_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT id, timestamp, mode, sample_count, f1_score, feature_version, deployed, artifact_path
+            FROM model_training_log
+            WHERE artifact_path IS NOT NULL
+            ORDER BY timestamp DESC
+        """)
+        rows = cur.fetchall()
+    return rows
+
+def promote(version_id):
+    # Loads the artifact first so a broken or incompatible file is never
+    # deployed, then makes it the only deployed version in one transaction
+    version = get_version(version_id)
+    if version is None or not version["artifact_path"]:
+        raise ValueError(f"Model version {version_id} has no registered artifact")
+    if version["feature_version"] != FEATURE_VERSION:
+        raise ValueError(f"Model version {version_id} uses feature version {version['feature_version']}, "
+                         f"current code expects {FEATURE_VERSION}")
+
+    t0 = time.time()
+    joblib.load(version["artifact_path"])
+    load_seconds = time.time() - t0
+
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("UPDATE model_training_log SET deployed = (id = %s) WHERE deployed OR id = %s", (version_id, version_id))
+
+    # Keep the legacy path pointing at the deployed model for file-based loaders
+    tmp_path = MODEL_OUTPUT + ".tmp"
+    shutil.copy(version["artifact_path"], tmp_path)
+    os.replace(tmp_path, MODEL_OUTPUT)
+
+    print(f"✅ Promoted model version {version_id} (artifact loads in {load_seconds:.2f}s)")
+    return load_seconds
@@ -1,23 +1,12 @@
-import psycopg2
+from db import get_conn
 
 def load_nickname_map_from_db():
-    DB = {
-        "host": "localhost",
-        "port": 5432,
-        "dbname": "mydb",
-        "user": "postgres",
-        "password": "mypassword"
-    }
-
     nickname_dict = {}
     try:
-        conn = psycopg2.connect(**DB)
-        cur = conn.cursor()
-        cur.execute("SELECT nickname, canonical FROM nicknames")
-        for nickname, canonical in cur.fetchall():
-            nickname_dict[nickname.lower()] = canonical.lower()
-        cur.close()
-        conn.close()
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute("SELECT nickname, canonical FROM nicknames")
+            for nickname, canonical in cur.fetchall():
+                nickname_dict[nickname.lower()] = canonical.lower()
     except Exception as e:
         print(f"❌ Error loading nickname map from DB: {e}")
 
@@ -1,12 +1,12 @@
 import os
-import psycopg2
 import random
 import base64
 from datetime import datetime, timedelta
 from faker import Faker
 from faker.providers import BaseProvider
 from PIL import Image
-from embedding_cache import encode_image_b64_to_vector
+from embedding_cache import encode_images_batch
+from db import get_conn, register_vector_types
 
 FILE_RANGE = 1000
 
@@ -23,23 +23,11 @@ fake = Faker([
     'ar_AE',  # Arabic (UAE)
 ])
 
-DB = {
-    "host": "localhost",
-    "port": 5432,
-    "dbname": "mydb",
-    "user": "postgres",
-    "password": "mypassword"
-}
-
 HEADSHOT_DIR = "faces"
 
 start_time = datetime.now()
 print("⏱️ Starting ingestion process @ %s..." % start_time.strftime('%Y-%m-%d %H:%M:%S'))
 
-conn = psycopg2.connect(**DB)
-cur = conn.cursor()
-
-print("✅ Connected to PostgreSQL database")
 print("✅ Using headshots from directory: %s" % HEADSHOT_DIR)
 print("✅ Using %s files for random people generation" % FILE_RANGE)
 
@@ -65,37 +53,46 @@ def generate_person():
     with open(os.path.join(HEADSHOT_DIR, headshot_file), "rb") as img:
         headshot_b64 = base64.b64encode(img.read()).decode("utf-8")
 
-    embedding = encode_image_b64_to_vector(headshot_b64)
-
-    return (person_id, first_nm, last_nm, birth_dt, mdm_person_id, email, headshot_b64, embedding)
+    return (person_id, first_nm, last_nm, birth_dt, mdm_person_id, email, headshot_b64)
 
-cur.execute("""
-    CREATE TABLE IF NOT EXISTS people_with_faces (
-        id SERIAL PRIMARY KEY,
-        person_id INT,
-        first_nm TEXT,
-        last_nm TEXT,
-        birth_dt DATE,
-        mdm_person_id BIGINT,
-        email_address TEXT,
-        headshot_b64 TEXT,
-        face_embedding VECTOR(512)
-    );
-""")
+with get_conn() as conn:
+    cur = conn.cursor()
+    print("✅ Connected to PostgreSQL database")
 
-
-people = [generate_person() for _ in range(FILE_RANGE)]
-for p in people:
+    cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
     cur.execute("""
-        INSERT INTO people_with_faces
-        (person_id, first_nm, last_nm, birth_dt, mdm_person_id, email_address, headshot_b64, face_embedding)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-    """, p)
-    # print("✅ Ingested person: %s %s, ID: %s" % (p[0], p[1], p[3]))
-
-conn.commit()
-cur.close()
-conn.close()
+        CREATE TABLE IF NOT EXISTS people_with_faces (
+            id SERIAL PRIMARY KEY,
+            person_id INT,
+            first_nm TEXT,
+            last_nm TEXT,
+            birth_dt DATE,
+            mdm_person_id BIGINT,
+            email_address TEXT,
+            headshot_b64 TEXT,
+            face_embedding VECTOR(512)
+        );
+    """)
+    # The vector type may have just been created; register it on this connection
+    conn.commit()
+    register_vector_types(conn)
+
+
+    people = [generate_person() for _ in range(FILE_RANGE)]
+
+    # Encode all headshots in batched CLIP forward passes; rows stay float32
+    # arrays and bind through the pgvector adapter
+    embeddings = encode_images_batch([p[6] for p in people])
+    people = [p + (emb,) for p, emb in zip(people, embeddings)]
+
+    for p in people:
+        cur.execute("""
+            INSERT INTO people_with_faces
+            (person_id, first_nm, last_nm, birth_dt, mdm_person_id, email_address, headshot_b64, face_embedding)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, p)
+        # print("✅ Ingested person: %s %s, ID: %s" % (p[0], p[1], p[3]))
+
 print("✅ Ingested %s people with embeddings" % FILE_RANGE)
 print("⏱️ Finished ingestion process @ %s" % datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
 print("Total time taken: %s seconds" % (datetime.now() - start_time).total_seconds())
@@ -1,92 +1,245 @@
+import argparse
+import os
+import time
 import pandas as pd
-import psycopg2
+from psycopg2.extras import execute_values
 import joblib
+import xgboost as xgb
+import model_registry
+from db import get_conn
 from train_model import train_model_from_df
-from sklearn.metrics import classification_report
+from feature_store import load_feature_store, FEATURE_STORE_PATH
+from extract_features import FEATURE_VERSION, FEATURE_COLUMNS
+from sklearn.metrics import classification_report, f1_score
 from sklearn.model_selection import train_test_split
 
-DB = {
-    "host": "localhost",
-    "port": 5432,
-    "dbname": "mydb",
-    "user": "postgres",
-    "password": "mypassword"
-}
-
 MODEL_OUTPUT = "dedup_model.pkl"
 
+# Extra boosting rounds added per incremental run
+INCREMENTAL_ROUNDS = 20
+# New feedback rows needed before a slice is held out to score an incremental run
+INCREMENTAL_MIN_HOLDOUT_ROWS = 10
+
+def ensure_tables():
+    # Feature vectors are computed once per feedback row (and feature version)
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS feedback_features (
+                feedback_id INT NOT NULL,
+                feature_version INT NOT NULL,
+                %s,
+                label INT NOT NULL,
+                created_at TIMESTAMP DEFAULT now(),
+                PRIMARY KEY (feedback_id, feature_version)
+            );
+        """ % ",\n                ".join(f"{col} REAL" for col in FEATURE_COLUMNS))
+    model_registry.ensure_registry()
+
 # Extract feedback-labeled pairs and rebuild feature vectors
-def fetch_feedback_pairs():
-    conn = psycopg2.connect(**DB)
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT input_first, input_last, input_dob, input_img,
-               matched_id, match_score, label
-        FROM user_feedback_log
-    """)
-    rows = cur.fetchall()
-    columns = [desc[0] for desc in cur.description]
-    cur.close()
-    conn.close()
+def fetch_feedback_pairs(only_uncached=False):
+    with get_conn() as conn, conn.cursor() as cur:
+        if only_uncached:
+            cur.execute("""
+                SELECT f.id AS feedback_id, f.input_first, f.input_last, f.input_dob, f.input_img,
+                       f.matched_id, f.match_score, f.label
+                FROM user_feedback_log f
+                LEFT JOIN feedback_features ff
+                  ON ff.feedback_id = f.id AND ff.feature_version = %s
+                WHERE ff.feedback_id IS NULL
+                ORDER BY f.id
+            """, (FEATURE_VERSION,))
+        else:
+            cur.execute("""
+                SELECT id AS feedback_id, input_first, input_last, input_dob, input_img,
+                       matched_id, match_score, label
+                FROM user_feedback_log
+                ORDER BY id
+            """)
+        rows = cur.fetchall()
+        columns = [desc[0] for desc in cur.description]
     return pd.DataFrame(rows, columns=columns)
 
 def rebuild_training_df(feedback_df):
-    import base64
-    from extract_features import extract_feature_vector_for_pair
-    from vector_search import get_candidate_by_id
-
-    pairs = []
-    for _, row in feedback_df.iterrows():
-        b_id = row["matched_id"]
-        b_record = get_candidate_by_id(b_id)
-        if b_record is None:
-            continue
-
-        pair = {
-            'a_first': row['input_first'],
-            'b_first': b_record['first_nm'],
-            'a_last': row['input_last'],
-            'b_last': b_record['last_nm'],
-            'a_birth': row['input_dob'],
-            'b_birth': b_record['birth_dt'],
-            'a_email': None,
-            'b_email': b_record['email_address'],
-            'a_mdm': None,
-            'b_mdm': b_record['mdm_person_id'],
-            'a_img': row['input_img'],
-            'b_img': b_record['headshot_b64'],
-            'label': row['label']
-        }
-        vec = extract_feature_vector_for_pair(pair)
-        vec['label'] = row['label']
-        pairs.append(vec)
-
-    return pd.DataFrame(pairs)
+    from extract_features import extract_features
+    from vector_search import get_candidates_by_ids
+
+    columns = ["feedback_id"] + FEATURE_COLUMNS + ["label"]
+    if feedback_df.empty:
+        return pd.DataFrame(columns=columns)
+
+    # All matched records in one query; stored face_embedding stands in for the
+    # headshot, which is only fetched for records that have no embedding yet
+    ids = feedback_df["matched_id"].dropna().astype(int).unique().tolist()
+    candidates = get_candidates_by_ids(ids, with_images=False).drop_duplicates("person_id")
+    no_embedding = candidates.loc[candidates["face_embedding"].isna(), "person_id"].tolist()
+    if no_embedding:
+        images = get_candidates_by_ids(no_embedding)[["person_id", "headshot_b64"]].drop_duplicates("person_id")
+        candidates = candidates.merge(images, on="person_id", how="left")
+    else:
+        candidates["headshot_b64"] = None
+
+    merged = feedback_df.merge(candidates, left_on="matched_id", right_on="person_id", how="inner")
+    if merged.empty:
+        return pd.DataFrame(columns=columns)
+
+    pairs = pd.DataFrame({
+        'a_first': merged['input_first'],
+        'b_first': merged['first_nm'],
+        'a_last': merged['input_last'],
+        'b_last': merged['last_nm'],
+        'a_birth': merged['input_dob'],
+        'b_birth': merged['birth_dt'],
+        'a_email': pd.Series(None, index=merged.index, dtype=object),
+        'b_email': merged['email_address'],
+        'a_mdm': None,
+        'b_mdm': merged['mdm_person_id'],
+        'a_img': merged['input_img'],
+        'b_img': merged['headshot_b64'],
+        'b_embedding': merged['face_embedding'],
+    })
+
+    # One batched feature pass for every feedback row
+    X, _ = extract_features(pairs)
+    training_df = X[FEATURE_COLUMNS].copy()
+    training_df["label"] = merged["label"].to_numpy()
+    training_df["feedback_id"] = merged["feedback_id"].to_numpy()
+    return training_df[columns]
+
+def sync_feedback_features():
+    # Compute and persist features only for feedback rows not cached yet
+    new_feedback = fetch_feedback_pairs(only_uncached=True)
+    if new_feedback.empty:
+        return 0
+
+    training_df = rebuild_training_df(new_feedback)
+    if training_df.empty:
+        return 0
+
+    cols = ["feedback_id", "feature_version"] + FEATURE_COLUMNS + ["label"]
+    training_df["feature_version"] = FEATURE_VERSION
+    with get_conn() as conn, conn.cursor() as cur:
+        execute_values(cur, """
+            INSERT INTO feedback_features (%s) VALUES %%s
+            ON CONFLICT (feedback_id, feature_version) DO NOTHING
+        """ % ", ".join(cols), [
+            tuple(int(v) if c in ("feedback_id", "feature_version", "label") else float(v) for c, v in zip(cols, row))
+            for row in training_df[cols].itertuples(index=False)
+        ])
+    return len(training_df)
+
+def load_feedback_features(after_id=0):
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT feedback_id, %s, label
+            FROM feedback_features
+            WHERE feature_version = %%s AND feedback_id > %%s
+            ORDER BY feedback_id
+        """ % ", ".join(FEATURE_COLUMNS), (FEATURE_VERSION, after_id))
+        rows = cur.fetchall()
+        columns = [desc[0] for desc in cur.description]
+    return pd.DataFrame(rows, columns=columns)
+
+def last_watermark():
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT watermark FROM model_training_log
+            WHERE watermark IS NOT NULL
+            ORDER BY timestamp DESC
+            LIMIT 1
+        """)
+        row = cur.fetchone()
+    return row[0] if row else 0
+
+def retrain_incremental(rounds=INCREMENTAL_ROUNDS):
+    # Continue boosting the deployed model on feedback newer than the last run
+    start_time = time.time()
+    watermark = last_watermark()
+    new_rows = load_feedback_features(after_id=watermark)
+    if new_rows.empty:
+        print(f"⚠️ No new feedback since watermark {watermark}. Skipping.")
+        return None
+
+    deployed = model_registry.get_deployed()
+    base = joblib.load(deployed["artifact_path"] if deployed else MODEL_OUTPUT)
+    params = base.get_params()
+    params["n_estimators"] = rounds
+    model = xgb.XGBClassifier(**params)
+
+    # F1 is measured on a held-out slice of the new rows, never on rows the
+    # model was boosted on. Held-out rows are still covered by the watermark;
+    # the next full retrain picks them up.
+    if len(new_rows) >= INCREMENTAL_MIN_HOLDOUT_ROWS and new_rows["label"].value_counts().min() >= 2:
+        train_rows, test_rows = train_test_split(new_rows, test_size=0.2, random_state=42,
+                                                 stratify=new_rows["label"])
+    else:
+        train_rows, test_rows = new_rows, None
+    model.fit(train_rows[FEATURE_COLUMNS], train_rows["label"], xgb_model=base.get_booster())
+
+    if test_rows is not None:
+        f1 = f1_score(test_rows["label"], model.predict(test_rows[FEATURE_COLUMNS]))
+    else:
+        f1 = None
+        print(f"⚠️ Only {len(new_rows)} new feedback rows; no held-out F1 for this run")
+    new_watermark = int(new_rows["feedback_id"].max())
+    duration = time.time() - start_time
+    model_registry.register_model(
+        model, "incremental", len(train_rows),
+        metrics={"f1": f1, "holdout_rows": 0 if test_rows is None else len(test_rows),
+                 "base_version": deployed["id"] if deployed else None},
+        watermark=new_watermark, duration_s=duration, deploy=True
+    )
+    f1_text = "n/a" if f1 is None else f"{f1:.3f}"
+    print(f"✅ Boosted {rounds} more rounds on {len(train_rows)} new feedback rows in {duration:.2f}s "
+          f"(watermark {watermark} → {new_watermark}, held-out f1={f1_text})")
+    return model
 
 if __name__ == "__main__":
-    feedback_df = fetch_feedback_pairs()
-    print(f"📊 Found {len(feedback_df)} labeled feedback pairs")
+    parser = argparse.ArgumentParser(description="Retrain the dedup model from user feedback")
+    parser.add_argument("--incremental", action="store_true",
+                        help="continue boosting the deployed model on feedback since the last run")
+    parser.add_argument("--rounds", type=int, default=INCREMENTAL_ROUNDS)
+    parser.add_argument("--with-synthetic", action="store_true",
+                        help="also train on the synthetic-pair feature store built by train_model.py")
+    parser.add_argument("--features", default=FEATURE_STORE_PATH)
+    args = parser.parse_args()
 
-    if len(feedback_df) < 10:
-        print("⚠️ Not enough feedback samples to retrain. Skipping.")
+    start_time = time.time()
+    ensure_tables()
+    added = sync_feedback_features()
+    print(f"✅ Cached features for {added} new feedback rows")
+
+    if args.incremental:
+        retrain_incremental(args.rounds)
         exit()
 
-    training_df = rebuild_training_df(feedback_df)
-    print(f"✅ Rebuilt training set with {len(training_df)} samples")
+    training_df = load_feedback_features()
+    print(f"📊 Found {len(training_df)} labeled feedback pairs")
+
+    if len(training_df) < 10:
+        print("⚠️ Not enough feedback samples to retrain. Skipping.")
+        exit()
 
     # Split data into training and test sets
-    X = training_df.drop(columns=["label"])
+    X = training_df[FEATURE_COLUMNS]
     y = training_df["label"]
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
+    train_df = pd.concat([X_train, y_train], axis=1)
+    if args.with_synthetic and os.path.exists(args.features):
+        X_syn, y_syn = load_feature_store(args.features)
+        train_df = pd.concat([pd.concat([X_syn, y_syn.rename("label")], axis=1), train_df], ignore_index=True)
+        print(f"✅ Added {len(X_syn)} synthetic pairs from {args.features}")
+
     # Retrain model
-    model = train_model_from_df(pd.concat([X_train, y_train], axis=1))
-    joblib.dump(model, MODEL_OUTPUT)
-    print(f"✅ Saved retrained model to {MODEL_OUTPUT}")
+    model = train_model_from_df(train_df)
 
     # Evaluate
     y_pred = model.predict(X_test)
     print("\n📈 Validation Report:")
     print(classification_report(y_test, y_pred))
-    print("✅ Model retraining complete")
\ No newline at end of file
+
+    model_registry.register_model(
+        model, "full", len(train_df), metrics={"f1": f1_score(y_test, y_pred)},
+        watermark=int(training_df["feedback_id"].max()), duration_s=time.time() - start_time, deploy=True
+    )
+    print("✅ Model retraining complete")
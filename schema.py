@@ -0,0 +1,163 @@
+# schema.py
+#
+# Idempotent database setup for candidate retrieval: the extensions it needs,
+# the secondary indexes on people_with_faces (pg_trgm GIN indexes for fuzzy
+# name search, btree indexes for exact lookups) and the phonetic blocking-key
+# columns with the trigger that maintains them. Safe to re-run.
+# The face_embedding ANN index is managed separately (ann_index.py).
+#
+#   python schema.py
+#   python schema.py --concurrently   # on a live table, without blocking writes
+#   python schema.py --backfill       # (re)compute blocking keys for existing rows
+
+import argparse
+import time
+from psycopg2 import sql
+from db import get_conn
+
+TABLE = "people_with_faces"
+
+EXTENSIONS = ["vector", "pg_trgm", "fuzzystrmatch"]
+
+# index name -> definition; expressions must match vector_search's text query
+TEXT_INDEXES = {
+    "people_with_faces_first_nm_trgm_idx": "USING gin (lower(first_nm) gin_trgm_ops)",
+    "people_with_faces_last_nm_trgm_idx": "USING gin (lower(last_nm) gin_trgm_ops)",
+    "people_with_faces_email_lower_idx": "(lower(email_address))",
+    "people_with_faces_mdm_person_id_idx": "(mdm_person_id)",
+    "people_with_faces_birth_dt_idx": "(birth_dt)",
+    "people_with_faces_person_id_idx": "(person_id)",
+}
+
+# Record-linkage blocking keys, filled by a BEFORE INSERT/UPDATE trigger:
+# nickname-canonical first name, Double Metaphone codes of first / last name
+# and birth year. Candidates only need to agree on one block (see
+# vector_search.find_blocking_candidates).
+BLOCKING_COLUMNS = {
+    "first_nm_canonical": "TEXT",
+    "first_nm_dmeta": "TEXT",
+    "last_nm_dmeta": "TEXT",
+    "birth_year": "SMALLINT",
+}
+
+BLOCKING_INDEXES = {
+    "people_with_faces_block_canonical_last_idx": "(first_nm_canonical, last_nm_dmeta)",
+    "people_with_faces_block_last_year_idx": "(last_nm_dmeta, birth_year)",
+    "people_with_faces_block_first_year_idx": "(first_nm_dmeta, birth_year)",
+}
+
+BLOCKING_KEY_SQL = {
+    "first_nm_canonical": "canonical_first_name({first_nm})",
+    "first_nm_dmeta": "nullif(dmetaphone({first_nm}), '')",
+    "last_nm_dmeta": "nullif(dmetaphone({last_nm}), '')",
+    "birth_year": "extract(year FROM {birth_dt})::smallint",
+}
+
+def ensure_extensions(cur):
+    for ext in EXTENSIONS:
+        cur.execute(sql.SQL("CREATE EXTENSION IF NOT EXISTS {}").format(sql.Identifier(ext)))
+
+def ensure_indexes(cur, indexes, concurrently=False):
+    for name, definition in indexes.items():
+        t0 = time.time()
+        cur.execute(sql.SQL("CREATE INDEX {concurrently} IF NOT EXISTS {name} ON {table} {definition}").format(
+            concurrently=sql.SQL("CONCURRENTLY" if concurrently else ""),
+            name=sql.Identifier(name),
+            table=sql.Identifier(TABLE),
+            definition=sql.SQL(definition),
+        ))
+        print(f"✅ {name} ready ({time.time() - t0:.1f}s)")
+
+def ensure_blocking_keys(cur):
+    # nicknames is normally loaded by hand (see README); an empty table keeps
+    # canonical_first_name valid until it is
+    cur.execute("CREATE TABLE IF NOT EXISTS nicknames (nickname TEXT, canonical TEXT)")
+    cur.execute("CREATE INDEX IF NOT EXISTS nicknames_nickname_lower_idx ON nicknames (lower(nickname))")
+    # Same nickname -> canonical resolution for stored rows and for queries
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION canonical_first_name(name TEXT) RETURNS TEXT
+        LANGUAGE sql STABLE AS $$
+            SELECT coalesce(
+                (SELECT lower(canonical) FROM nicknames
+                 WHERE lower(nickname) = lower(trim(name))
+                 ORDER BY canonical LIMIT 1),
+                nullif(lower(trim(name)), '')
+            )
+        $$;
+    """)
+
+    cur.execute(sql.SQL("ALTER TABLE {} {}").format(
+        sql.Identifier(TABLE),
+        sql.SQL(", ").join(
+            sql.SQL("ADD COLUMN IF NOT EXISTS {} {}").format(sql.Identifier(col), sql.SQL(col_type))
+            for col, col_type in BLOCKING_COLUMNS.items()
+        )
+    ))
+
+    assignments = ";\n            ".join(
+        f"NEW.{col} := " + expr.format(first_nm="NEW.first_nm", last_nm="NEW.last_nm", birth_dt="NEW.birth_dt")
+        for col, expr in BLOCKING_KEY_SQL.items()
+    )
+    cur.execute(f"""
+        CREATE OR REPLACE FUNCTION people_with_faces_blocking_keys() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            {assignments};
+            RETURN NEW;
+        END
+        $$;
+    """)
+    cur.execute(f"DROP TRIGGER IF EXISTS people_with_faces_blocking_keys_trg ON {TABLE}")
+    cur.execute(f"""
+        CREATE TRIGGER people_with_faces_blocking_keys_trg
+        BEFORE INSERT OR UPDATE OF first_nm, last_nm, birth_dt ON {TABLE}
+        FOR EACH ROW EXECUTE FUNCTION people_with_faces_blocking_keys()
+    """)
+
+def backfill_blocking_keys(batch_size=10000, only_missing=True):
+    # Batches by id so a large table is not rewritten in one transaction.
+    # Re-run without only_missing after reloading the nicknames table.
+    assignments = ", ".join(
+        f"{col} = " + expr.format(first_nm="first_nm", last_nm="last_nm", birth_dt="birth_dt")
+        for col, expr in BLOCKING_KEY_SQL.items()
+    )
+    where = "AND first_nm_canonical IS NULL AND first_nm_dmeta IS NULL AND last_nm_dmeta IS NULL" if only_missing else ""
+
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(f"SELECT coalesce(min(id), 0), coalesce(max(id), -1) FROM {TABLE}")
+        lo, hi = cur.fetchone()
+
+    updated = 0
+    t0 = time.time()
+    for start in range(lo, hi + 1, batch_size):
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute(f"UPDATE {TABLE} SET {assignments} WHERE id >= %s AND id < %s {where}",
+                        (start, start + batch_size))
+            updated += cur.rowcount
+    print(f"✅ Backfilled blocking keys on {updated} rows in {time.time() - t0:.1f}s")
+    return updated
+
+def setup_schema(concurrently=False):
+    with get_conn() as conn:
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+        conn.autocommit = concurrently
+        try:
+            with conn.cursor() as cur:
+                ensure_extensions(cur)
+                ensure_blocking_keys(cur)
+                ensure_indexes(cur, TEXT_INDEXES, concurrently)
+                ensure_indexes(cur, BLOCKING_INDEXES, concurrently)
+                cur.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(TABLE)))
+        finally:
+            conn.autocommit = False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create extensions and retrieval indexes on people_with_faces")
+    parser.add_argument("--concurrently", action="store_true", help="build indexes without blocking writes")
+    parser.add_argument("--backfill", action="store_true", help="compute blocking keys for rows that have none")
+    parser.add_argument("--backfill-all", action="store_true", help="recompute blocking keys for every row")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+    setup_schema(args.concurrently)
+    if args.backfill or args.backfill_all:
+        backfill_blocking_keys(args.batch_size, only_missing=not args.backfill_all)
@@ -1,19 +1,136 @@
+import os
+import threading
+import time
+import numpy as np
 import pandas as pd
 import joblib
-from extract_features import extract_features
+import xgboost as xgb
+from extract_features import extract_feature_matrix, FEATURE_COLUMNS, FEATURE_VERSION
 
-# Load model once
-model = joblib.load("dedup_model.pkl")
+MODEL_PATH = "dedup_model.pkl"
+# How often (seconds) to ask the registry whether a new version was promoted
+RELOAD_CHECK_SECONDS = float(os.environ.get("MODEL_RELOAD_CHECK_SECONDS", 30))
+
+class LoadedModel:
+    def __init__(self, classifier, version_id, artifact_path, load_seconds):
+        self.classifier = classifier
+        self.booster = classifier.get_booster()
+        self.version_id = version_id
+        self.artifact_path = artifact_path
+        self.load_seconds = load_seconds
+
+def _load(artifact_path, version_id=None):
+    t0 = time.time()
+    classifier = joblib.load(artifact_path)
+    loaded = LoadedModel(classifier, version_id, artifact_path, time.time() - t0)
+    print(f"✅ Loaded model version {version_id} from {artifact_path} in {loaded.load_seconds:.2f}s")
+    return loaded
+
+class ModelHolder:
+    # Keeps the deployed model in memory and swaps in newly promoted versions.
+    # Each request grabs self.current once, so a swap never affects scoring
+    # already in flight; new versions load on a background thread.
+
+    def __init__(self):
+        self.current = None
+        self._lock = threading.Lock()
+        self._loading = False
+        self._last_check = 0.0
+
+    def get(self) -> LoadedModel:
+        if self.current is None:
+            with self._lock:
+                if self.current is None:
+                    self.current = self._initial_load()
+                    self._last_check = time.monotonic()
+        self._maybe_check()
+        return self.current
+
+    def _initial_load(self):
+        try:
+            import model_registry
+            deployed = model_registry.get_deployed()
+            if deployed and deployed["feature_version"] == FEATURE_VERSION:
+                return _load(deployed["artifact_path"], deployed["id"])
+        except Exception as e:
+            print(f"⚠️ Model registry unavailable, falling back to {MODEL_PATH}: {e}")
+        return _load(MODEL_PATH)
+
+    def _maybe_check(self):
+        now = time.monotonic()
+        if self._loading or now - self._last_check < RELOAD_CHECK_SECONDS:
+            return
+        with self._lock:
+            if self._loading or now - self._last_check < RELOAD_CHECK_SECONDS:
+                return
+            self._last_check = now
+            self._loading = True
+        threading.Thread(target=self._reload_if_promoted, name="model-reload", daemon=True).start()
+
+    def _reload_if_promoted(self):
+        try:
+            import model_registry
+            deployed = model_registry.get_deployed()
+            if deployed is None or deployed["id"] == self.current.version_id:
+                return
+            if deployed["feature_version"] != FEATURE_VERSION:
+                print(f"⚠️ Skipping model version {deployed['id']}: feature version "
+                      f"{deployed['feature_version']} != {FEATURE_VERSION}")
+                return
+            # Plain attribute assignment is atomic; readers see the old or the new model
+            self.current = _load(deployed["artifact_path"], deployed["id"])
+        except Exception as e:
+            print(f"⚠️ Model reload check failed: {e}")
+        finally:
+            self._loading = False
+
+holder = ModelHolder()
+
+def get_model() -> LoadedModel:
+    return holder.get()
+
+def model_info():
+    m = holder.get()
+    return {"version_id": m.version_id, "artifact_path": m.artifact_path, "load_seconds": m.load_seconds}
+
+def score_matrix(X: np.ndarray, explain=False):
+    # Match probabilities for an (N, len(FEATURE_COLUMNS)) feature matrix, straight
+    # from the native booster without DataFrame/sklearn-wrapper round trips.
+    # With explain=True also returns per-feature tree-SHAP contributions,
+    # shape (N, len(FEATURE_COLUMNS) + 1) with the bias term last.
+    booster = get_model().booster
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    if len(X) == 0:
+        scores = np.zeros(0, dtype=np.float32)
+        return (scores, np.zeros((0, X.shape[1] + 1), dtype=np.float32)) if explain else scores
+
+    if not explain:
+        return booster.inplace_predict(X)
+
+    # Contributions sum to the margin, so one pred_contribs call gives both
+    contribs = booster.predict(xgb.DMatrix(X, feature_names=booster.feature_names), pred_contribs=True)
+    scores = 1.0 / (1.0 + np.exp(-contribs.sum(axis=1)))
+    return scores, contribs
+
+def score_pairs(batch_df: pd.DataFrame) -> np.ndarray:
+    return score_matrix(extract_feature_matrix(batch_df))
 
 def score_batch(batch_df: pd.DataFrame) -> pd.DataFrame:
-    X, _ = extract_features(batch_df)
-    batch_df['score'] = model.predict_proba(X)[:, 1]
+    batch_df['score'] = score_pairs(batch_df)
     return batch_df.sort_values(by="score", ascending=False)
 
-def score_with_explanation(batch_df: pd.DataFrame) -> pd.DataFrame:
-    X, _ = extract_features(batch_df)
-    probs = model.predict_proba(X)[:, 1]
-    batch_df['score'] = probs
-    for i, col in enumerate(X.columns):
-        batch_df[f"feat_{col}"] = X[col]
-    return batch_df
\ No newline at end of file
+def score_with_explanation(batch_df: pd.DataFrame, explain=True) -> pd.DataFrame:
+    # feat_* columns hold the raw feature values, contrib_* their contribution
+    # to the match log-odds (contrib_bias is the model's base margin)
+    X = extract_feature_matrix(batch_df)
+    if explain:
+        batch_df['score'], contribs = score_matrix(X, explain=True)
+    else:
+        batch_df['score'] = score_matrix(X)
+    for i, col in enumerate(FEATURE_COLUMNS):
+        batch_df[f"feat_{col}"] = X[:, i]
+        if explain:
+            batch_df[f"contrib_{col}"] = contribs[:, i]
+    if explain:
+        batch_df["contrib_bias"] = contribs[:, -1]
+    return batch_df
@@ -0,0 +1,51 @@
+# similarity.py
+#
+# Column-at-a-time similarity scorers shared by extract_features and
+# hybrid_search, so whole batches are scored without per-row Python calls.
+
+import os
+import numpy as np
+from difflib import SequenceMatcher
+from rapidfuzz import process
+from rapidfuzz.fuzz import partial_ratio
+
+# Threads used by rapidfuzz's native scorers (-1 = all cores)
+SIMILARITY_WORKERS = int(os.environ.get("SIMILARITY_WORKERS", -1))
+
+def _lowered(values):
+    return [str(v).lower() for v in values]
+
+def paired_partial_ratio(a, b, workers=SIMILARITY_WORKERS):
+    # Element-wise partial_ratio(str(a[i]).lower(), str(b[i]).lower()) / 100
+    if len(a) == 0:
+        return np.zeros(0, dtype=np.float64)
+    scores = process.cpdist(_lowered(a), _lowered(b), scorer=partial_ratio, dtype=np.float64, workers=workers)
+    return scores / 100.0
+
+def sequence_ratio_to_many(query, values):
+    # SequenceMatcher(None, query.lower(), v.lower()).ratio() for every v,
+    # scoring each distinct value only once
+    sm = SequenceMatcher(None)
+    sm.set_seq1(query.lower())
+    scores = {}
+    for v in values:
+        if v not in scores:
+            sm.set_seq2(v.lower())
+            scores[v] = sm.ratio()
+    return np.array([scores[v] for v in values], dtype=np.float64)
+
+def paired_cosine(a, b, valid=None):
+    # Row-wise cosine similarity of two (N, d) embedding arrays as one normalized
+    # dot product. Rows masked out by `valid`, or with an all-zero vector, score 0.0.
+    a = np.ascontiguousarray(a, dtype=np.float32)
+    b = np.ascontiguousarray(b, dtype=np.float32)
+    norm_a = np.linalg.norm(a, axis=1)
+    norm_b = np.linalg.norm(b, axis=1)
+
+    ok = (norm_a > 0) & (norm_b > 0)
+    if valid is not None:
+        ok &= np.asarray(valid, dtype=bool)
+
+    sims = np.zeros(len(a), dtype=np.float64)
+    sims[ok] = np.einsum("ij,ij->i", a[ok], b[ok]) / (norm_a[ok] * norm_b[ok])
+    return sims
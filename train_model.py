@@ -1,34 +1,70 @@
+import argparse
 import pandas as pd
 import xgboost as xgb
 import joblib
 import time
-from extract_features import extract_features
+from feature_store import load_or_build_features, PAIRS_PATH, FEATURE_STORE_PATH, CHUNK_SIZE
+from image_store import IMAGE_STORE_PATH
 
-# Load training pairs
-start_time = time.time()
-df = pd.read_csv("training_pairs_expanded.csv")
-print("✅ Finished reading training_pairs_expanded.csv into DataFrame in %s seconds" % (time.time() - start_time))
+MODEL_OUTPUT = "dedup_model.pkl"
 
-# Extract features and labels
-t1 = time.time()
-X, y = extract_features(df)
-print("✅ Finished feature extraction in %s seconds" % (time.time() - t1))
+def train_model_from_df(df: pd.DataFrame, n_estimators=100, max_depth=5, learning_rate=0.1):
+    X = df.drop(columns=["label"])
+    y = df["label"]
+    model = xgb.XGBClassifier(
+        n_estimators=n_estimators,
+        max_depth=max_depth,
+        learning_rate=learning_rate,
+        # use_label_encoder=False,
+        eval_metric='logloss'
+    )
+    model.fit(X, y)
+    return model
 
-# Train model
-t2 = time.time()
-model = xgb.XGBClassifier(
-    n_estimators=100,
-    max_depth=5,
-    learning_rate=0.1,
-    # use_label_encoder=False,
-    eval_metric='logloss'
-)
-model.fit(X, y)
-print("✅ Finished training model in %s seconds" % (time.time() - t2))
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the dedup scoring model")
+    parser.add_argument("--pairs", default=PAIRS_PATH)
+    parser.add_argument("--images", default=IMAGE_STORE_PATH, help="image store for compact (reference-based) pairs")
+    parser.add_argument("--features", default=FEATURE_STORE_PATH)
+    parser.add_argument("--rebuild-features", action="store_true", help="recompute the feature store even if it exists")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--n-estimators", type=int, default=100)
+    parser.add_argument("--max-depth", type=int, default=5)
+    parser.add_argument("--learning-rate", type=float, default=0.1)
+    args = parser.parse_args()
 
-# Save model
-t3 = time.time()
-joblib.dump(model, "dedup_model.pkl")
-print("✅ Finished saving dedup_model.pkl in %s seconds" % (time.time() - t3))
+    # Load features (extracting them from the training pairs only if needed)
+    start_time = time.time()
+    X, y = load_or_build_features(
+        args.pairs, args.features, rebuild=args.rebuild_features,
+        workers=args.workers, chunksize=args.chunksize, image_store_path=args.images
+    )
+    print("✅ Loaded %s feature rows in %s seconds" % (len(X), time.time() - start_time))
 
-print("✅ Finished training and saving model in %s seconds" % (time.time() - start_time))
+    # Train model
+    t2 = time.time()
+    model = train_model_from_df(
+        pd.concat([X, y.rename("label")], axis=1),
+        n_estimators=args.n_estimators,
+        max_depth=args.max_depth,
+        learning_rate=args.learning_rate
+    )
+    print("✅ Finished training model in %s seconds" % (time.time() - t2))
+
+    # Save model (registered and deployed when the database is reachable)
+    t3 = time.time()
+    try:
+        import model_registry
+        model_registry.ensure_registry()
+        model_registry.register_model(
+            model, "synthetic", len(X), metrics={"n_estimators": args.n_estimators, "max_depth": args.max_depth,
+                                                 "learning_rate": args.learning_rate},
+            duration_s=time.time() - start_time, deploy=True
+        )
+    except Exception as e:
+        print(f"⚠️ Could not register model ({e}); saving to {MODEL_OUTPUT} only")
+        joblib.dump(model, MODEL_OUTPUT)
+    print("✅ Finished saving model in %s seconds" % (time.time() - t3))
+
+    print("✅ Finished training and saving model in %s seconds" % (time.time() - start_time))
@@ -1,102 +1,386 @@
 # vector_search.py
 
-import psycopg2
+import os
+import numpy as np
 import pandas as pd
 from psycopg2 import sql
+from db import get_conn
+from ann_index import apply_search_params, distance_operator
 
-DB = {
-    "host": "localhost",
-    "port": 5432,
-    "dbname": "mydb",
-    "user": "postgres",
-    "password": "mypassword"
-}
+# Retrieval returns these scalar fields only; headshot_b64 blobs are fetched
+# afterwards for the few candidates actually displayed (fetch_headshots)
+SCALAR_COLUMNS = ["person_id", "first_nm", "last_nm", "birth_dt", "mdm_person_id", "email_address"]
+CANDIDATE_COLUMNS = SCALAR_COLUMNS + ["face_embedding"]
 
-def connect_db():
-    return psycopg2.connect(**DB)
-
-def find_similar_faces(vec, top_k=10):
-    conn = psycopg2.connect(**DB)
-    cur = conn.cursor()
-
-    vec_literal = "[" + ",".join(map(str, vec)) + "]"
-
-    cur.execute("""
-        SELECT
-          person_id,
-          first_nm,
-          last_nm,
-          birth_dt,
-          mdm_person_id,
-          email_address,
-          headshot_b64,
-          face_embedding <-> %s::vector AS distance
-        FROM people_with_faces
-        ORDER BY face_embedding <-> %s::vector
-        LIMIT %s
-    """, (vec_literal, vec_literal, top_k))
-
-    rows = cur.fetchall()
-    
-    # pull column names dynamically
-    col_names = [desc[0] for desc in cur.description]
-    
-    cur.close()
-    conn.close()
-    return pd.DataFrame(
-        rows,
-        columns=col_names
-        # columns=[
-        #   "person_id",
-        #   "first_nm",
-        #   "last_nm",
-        #   "birth_dt",
-        #   "mdm_person_id",
-        #   "email_address",
-        #   "headshot_b64",
-        #   "distance"
-        # ]
-    )
+def _select_list(with_embedding):
+    cols = SCALAR_COLUMNS + (["face_embedding"] if with_embedding else [])
+    return sql.SQL(", ").join(map(sql.Identifier, cols))
 
+def find_similar_faces(vec, top_k=10, with_embedding=False, ef_search=None, probes=None, exact=False):
+    # The query vector is bound once as a float32 array (pgvector adapter)
+    # and referenced by name for both the distance column and the ordering.
+    # with_embedding adds the stored face_embedding so candidates can be
+    # scored without their images.
+    # ef_search / probes tune the HNSW / IVFFlat index for this query only
+    # (see ann_index); exact=True forces a sequential scan.
+    vec = np.asarray(vec, dtype=np.float32)
+    op = sql.SQL(distance_operator())
 
-def find_similar_textual(first_nm=None, last_nm=None, email=None, mdm=None, dob=None, top_k=50):
-    filters = []
-    params = []
+    with get_conn() as conn, conn.cursor() as cur:
+        apply_search_params(cur, top_k, ef_search, probes, exact)
+        cur.execute(sql.SQL("""
+            SELECT
+              {cols},
+              face_embedding {op} q.vec AS distance
+            FROM people_with_faces, (SELECT %s::vector AS vec) q
+            ORDER BY face_embedding {op} q.vec
+            LIMIT %s
+        """).format(cols=_select_list(with_embedding), op=op), (vec, top_k))
 
-    if first_nm:
-        filters.append("first_nm ILIKE %s")
-        params.append(f"{first_nm}%")
+        rows = cur.fetchall()
 
-    if last_nm:
-        filters.append("last_nm ILIKE %s")
-        params.append(f"{last_nm}%")
+        # pull column names dynamically
+        col_names = [desc[0] for desc in cur.description]
 
-    if email:
-        filters.append("email_address ILIKE %s")
-        params.append(f"{email}%")
+    return pd.DataFrame(rows, columns=col_names)
+
+# Query vectors per statement in find_similar_faces_batch
+BATCH_QUERY_CHUNK = int(os.environ.get("BATCH_QUERY_CHUNK", 256))
+
+def find_similar_faces_batch(vectors, top_k=10, with_embedding=False, ef_search=None, probes=None,
+                             exact=False, chunk_size=BATCH_QUERY_CHUNK):
+    # Nearest neighbours for many query vectors in one statement per chunk:
+    # the vectors are sent as one vector[] parameter, unnested WITH ORDINALITY,
+    # and each row drives a LATERAL ORDER BY ... LIMIT that uses the ANN index.
+    # Long format: one row per (query_idx, rank), query_idx being the 0-based
+    # position in vectors.
+    empty = pd.DataFrame(columns=["query_idx", "rank"] + SCALAR_COLUMNS + ["distance"])
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.size == 0:
+        return empty
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+
+    query = sql.SQL("""
+        SELECT q.query_idx - 1 AS query_idx, c.*
+        FROM unnest(%s::vector[]) WITH ORDINALITY AS q(vec, query_idx)
+        CROSS JOIN LATERAL (
+            SELECT row_number() OVER (ORDER BY nn.distance) AS rank, nn.*
+            FROM (
+                SELECT {cols}, face_embedding {op} q.vec AS distance
+                FROM people_with_faces
+                ORDER BY face_embedding {op} q.vec
+                LIMIT %s
+            ) nn
+        ) c
+        ORDER BY q.query_idx, c.rank
+    """).format(cols=_select_list(with_embedding), op=sql.SQL(distance_operator()))
+
+    frames = []
+    with get_conn() as conn, conn.cursor() as cur:
+        apply_search_params(cur, top_k, ef_search, probes, exact)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = list(vectors[start:start + chunk_size])
+            cur.execute(query, (chunk, top_k))
+            df = pd.DataFrame(cur.fetchall(), columns=[desc[0] for desc in cur.description])
+            df["query_idx"] += start
+            frames.append(df)
+
+    return pd.concat(frames, ignore_index=True)
+
+
+# Weights of each matched field in text_match_score; names contribute their trigram
+# similarity (0..1), the exact-match fields all or nothing
+TEXT_SCORE_WEIGHTS = {
+    "first_nm": 0.25,
+    "last_nm": 0.25,
+    "email": 0.2,
+    "mdm": 0.3,
+    "dob": 0.1,
+}
+# pg_trgm similarity a name needs to become a candidate (the % operator)
+TRGM_THRESHOLD = float(os.environ.get("TRGM_THRESHOLD", 0.3))
 
-    if mdm:
-        filters.append("CAST(mdm_person_id AS TEXT) ILIKE %s")
-        params.append(f"{mdm}%")
+def _text_terms(first_nm=None, last_nm=None, email=None, mdm=None, dob=None):
+    # (params, WHERE predicates, text_match_score expression) for the given
+    # query fields, or None when there is nothing to search on
+    params, filters, scores = {}, [], []
 
+    for field, value in (("first_nm", first_nm), ("last_nm", last_nm)):
+        if value:
+            params[field] = value.strip().lower()
+            filters.append(f"lower({field}) %% %({field})s")
+            scores.append(f"similarity(lower({field}), %({field})s) * {TEXT_SCORE_WEIGHTS[field]}")
+
+    exact = []
+    if email:
+        params["email"] = email.strip().lower()
+        exact.append(("email", "lower(email_address) = %(email)s"))
+    if mdm and str(mdm).strip().isdigit():
+        params["mdm"] = int(str(mdm).strip())
+        exact.append(("mdm", "mdm_person_id = %(mdm)s"))
     if dob:
-        filters.append("birth_dt = %s")
-        params.append(dob)
+        params["dob"] = dob
+        exact.append(("dob", "birth_dt = %(dob)s"))
+    for key, predicate in exact:
+        filters.append(predicate)
+        scores.append(f"CASE WHEN {predicate} THEN {TEXT_SCORE_WEIGHTS[key]} ELSE 0 END")
 
     if not filters:
+        return None
+    return params, filters, " + ".join(scores)
+
+def text_candidates_sql(first_nm=None, last_nm=None, email=None, mdm=None, dob=None, top_k=50, with_embedding=False):
+    # Builds the ranked text-candidate query as a plain string with %(name)s
+    # parameters (shared with the async path). Every predicate is served by an
+    # index from schema.py: trigram GIN for names, btree for the exact fields.
+    # Returns (None, None) when there is nothing to search on.
+    terms = _text_terms(first_nm, last_nm, email, mdm, dob)
+    if terms is None:
+        return None, None
+    params, filters, score = terms
+    params["top_k"] = top_k
+
+    cols = SCALAR_COLUMNS + (["face_embedding"] if with_embedding else [])
+    query = f"""
+        SELECT {", ".join(cols)},
+               {score} AS text_match_score
+        FROM people_with_faces
+        WHERE {" OR ".join(filters)}
+        ORDER BY text_match_score DESC
+        LIMIT %(top_k)s
+    """
+    return query, params
+
+def find_similar_textual(first_nm=None, last_nm=None, email=None, mdm=None, dob=None, top_k=50,
+                         with_embedding=False, min_similarity=None):
+    # Ranked fuzzy candidates with a text_match_score column (see text_candidates_sql)
+    query, params = text_candidates_sql(first_nm, last_nm, email, mdm, dob, top_k, with_embedding)
+    if query is None:
         return pd.DataFrame()  # Avoid full table scan
 
-    query = sql.SQL("""SELECT * FROM people_with_faces WHERE {conditions} LIMIT %s""").format( conditions=sql.SQL(" OR ").join(map(sql.SQL, filters)))
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, true)",
+                    (str(min_similarity or TRGM_THRESHOLD),))
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        cols = [desc[0] for desc in cur.description]
+    return pd.DataFrame(rows, columns=cols)
+
+# Query-side blocking keys, computed with the same functions as the trigger.
+# They take the name as entered: canonical_first_name does the nickname
+# resolution, and the stored dmetaphone codes are of the raw name.
+BLOCK_KEYS_SQL = """
+    SELECT canonical_first_name(%(block_first_nm)s) AS first_canonical,
+           nullif(dmetaphone(%(block_first_nm)s), '') AS first_dmeta,
+           nullif(dmetaphone(%(block_last_nm)s), '') AS last_dmeta,
+           %(birth_year)s::smallint AS birth_year
+"""
+
+def _blocking_terms(first_nm=None, last_nm=None, dob=None):
+    # (params, block predicates over p / bq, block_hits expression), or None
+    # when no block can be formed
+    first_nm = first_nm.strip().lower() if first_nm else None
+    last_nm = last_nm.strip().lower() if last_nm else None
+    params = {"block_first_nm": first_nm, "block_last_nm": last_nm,
+              "birth_year": int(str(dob)[:4]) if dob else None}
+
+    blocks = []
+    if first_nm and last_nm:
+        blocks.append("(p.first_nm_canonical = bq.first_canonical AND p.last_nm_dmeta = bq.last_dmeta)")
+    if last_nm and dob:
+        blocks.append("(p.last_nm_dmeta = bq.last_dmeta AND p.birth_year = bq.birth_year)")
+    if first_nm and dob:
+        blocks.append("(p.first_nm_dmeta = bq.first_dmeta AND p.birth_year = bq.birth_year)")
+    if not blocks:
+        return None
+    return params, blocks, " + ".join(f"coalesce(({b})::int, 0)" for b in blocks)
 
-    params.append(top_k)
+def blocking_candidates_sql(first_nm=None, last_nm=None, dob=None, top_k=200, with_embedding=False):
+    # Record-linkage blocking on the keys maintained by schema.py: a row is a
+    # candidate when it shares at least one block with the query, so the cost
+    # is the size of the matching blocks, not of the table.
+    # Returns (None, None) when no block can be formed.
+    terms = _blocking_terms(first_nm, last_nm, dob)
+    if terms is None:
+        return None, None
+    params, blocks, hits = terms
+    params["top_k"] = top_k
 
-    try:
-        conn = connect_db()
-        cur = conn.cursor()
+    cols = SCALAR_COLUMNS + (["face_embedding"] if with_embedding else [])
+    query = f"""
+        WITH bq AS ({BLOCK_KEYS_SQL})
+        SELECT {", ".join("p." + c for c in cols)},
+               {hits} AS block_hits
+        FROM bq, people_with_faces p
+        WHERE {" OR ".join(blocks)}
+        ORDER BY block_hits DESC
+        LIMIT %(top_k)s
+    """
+    return query, params
+
+def find_blocking_candidates(first_nm=None, last_nm=None, dob=None, top_k=200, with_embedding=False):
+    # Candidates sharing a blocking key with the query (nickname-canonical
+    # first name, Double Metaphone codes, birth year); block_hits counts how
+    # many blocks each one shares
+    query, params = blocking_candidates_sql(first_nm, last_nm, dob, top_k, with_embedding)
+    if query is None:
+        return pd.DataFrame()
+
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute(query, params)
         rows = cur.fetchall()
         cols = [desc[0] for desc in cur.description]
-        return pd.DataFrame(rows, columns=cols)
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+    return pd.DataFrame(rows, columns=cols)
+
+# Reciprocal-rank fusion constant: a candidate's rrf_score is the sum over
+# sources of 1 / (RRF_K + rank in that source)
+RRF_K = 60
+
+def hybrid_candidates_sql(vec=None, first_nm=None, last_nm=None, email=None, mdm=None, dob=None,
+                          image_k=50, text_k=50, block_k=50, top_k=100, with_embedding=False, rrf_k=RRF_K,
+                          block_first_nm=None):
+    # One statement for every retrieval source: ANN top-k on face_embedding,
+    # indexed trigram / exact text matches and phonetic blocks, each ranked in
+    # its own CTE, then merged per row with per-source ranks and scores and
+    # reciprocal-rank fusion. A source whose k is 0 is left out. Plain string
+    # with %(name)s parameters (shared with the async path); returns
+    # (None, None) when no source applies. first_nm may be nickname-normalized
+    # for the text source; block_first_nm is the name as entered (defaults to
+    # first_nm) so its dmetaphone code matches the stored one.
+    params = {"image_k": image_k, "text_k": text_k, "block_k": block_k, "top_k": top_k, "rrf_k": rrf_k}
+    ctes, sources = [], []
+
+    if vec is not None and image_k:
+        params["vec"] = np.asarray(vec, dtype=np.float32)
+        op = distance_operator()
+        # The vector is bound once, in a one-row subquery the planner folds
+        # into the ANN index scan
+        sources.append(("image", "distance", "ASC", f"""
+                SELECT p.id, p.face_embedding {op} q.vec AS value
+                FROM people_with_faces p, (SELECT %(vec)s::vector AS vec) q
+                ORDER BY p.face_embedding {op} q.vec
+                LIMIT %(image_k)s"""))
+
+    text = _text_terms(first_nm, last_nm, email, mdm, dob)
+    if text is not None and text_k:
+        text_params, filters, score = text
+        params.update(text_params)
+        sources.append(("text", "text_match_score", "DESC", f"""
+                SELECT id, {score} AS value
+                FROM people_with_faces
+                WHERE {" OR ".join(filters)}
+                ORDER BY value DESC
+                LIMIT %(text_k)s"""))
+
+    blocking = _blocking_terms(block_first_nm or first_nm, last_nm, dob)
+    if blocking is not None and block_k:
+        block_params, blocks, hits = blocking
+        params.update(block_params)
+        ctes.append(f"bq AS ({BLOCK_KEYS_SQL})")
+        sources.append(("block", "block_hits", "DESC", f"""
+                SELECT p.id, {hits} AS value
+                FROM bq, people_with_faces p
+                WHERE {" OR ".join(blocks)}
+                ORDER BY value DESC
+                LIMIT %(block_k)s"""))
+
+    if not sources:
+        return None, None
+
+    # Ranks are numbered after each source's LIMIT so the ANN query stays an
+    # index scan rather than a window over the whole table
+    for name, _, direction, inner in sources:
+        ctes.append(f"""{name}_hits AS (
+            SELECT id, value::float8 AS value, row_number() OVER (ORDER BY value {direction}) AS rank
+            FROM ({inner}
+            ) s
+        )""")
+    cte_sql = ",\n        ".join(ctes)
+    union_sql = "\n            UNION ALL ".join(
+        f"SELECT id, '{name}' AS source, value, rank FROM {name}_hits" for name, *_ in sources
+    )
+    per_source = ",\n                   ".join(
+        f"max(value) FILTER (WHERE source = '{name}') AS {value_col}, "
+        f"min(rank) FILTER (WHERE source = '{name}') AS {name}_rank"
+        for name, value_col, *_ in sources
+    )
+    cols = ", ".join("p." + c for c in SCALAR_COLUMNS + (["face_embedding"] if with_embedding else []))
+    query = f"""
+        WITH {cte_sql},
+        hits AS (
+            {union_sql}
+        ),
+        fused AS (
+            SELECT id,
+                   {per_source},
+                   sum(1.0 / (%(rrf_k)s + rank))::float8 AS rrf_score
+            FROM hits
+            GROUP BY id
+        )
+        SELECT {cols}, f.*
+        FROM fused f
+        JOIN people_with_faces p ON p.id = f.id
+        ORDER BY f.rrf_score DESC
+        LIMIT %(top_k)s
+    """
+    return query, params
+
+def find_hybrid_candidates(vec=None, first_nm=None, last_nm=None, email=None, mdm=None, dob=None,
+                           image_k=50, text_k=50, block_k=50, top_k=100, with_embedding=False,
+                           ef_search=None, probes=None, min_similarity=None, block_first_nm=None):
+    # Deduplicated image + text + blocking candidates in one round trip, ranked
+    # by rrf_score, with distance / text_match_score / block_hits and the rank
+    # from each source that found them (NULL where a source did not)
+    query, params = hybrid_candidates_sql(vec, first_nm, last_nm, email, mdm, dob,
+                                          image_k, text_k, block_k, top_k, with_embedding,
+                                          block_first_nm=block_first_nm)
+    if query is None:
+        return pd.DataFrame()
+
+    with get_conn() as conn, conn.cursor() as cur:
+        apply_search_params(cur, image_k, ef_search, probes)
+        cur.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, true)",
+                    (str(min_similarity or TRGM_THRESHOLD),))
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        cols = [desc[0] for desc in cur.description]
+    return pd.DataFrame(rows, columns=cols).drop(columns="id")
+
+def get_candidates_by_ids(person_ids, with_images=True):
+    # One round trip for any number of ids instead of one query per id
+    person_ids = [int(pid) for pid in person_ids]
+    cols = CANDIDATE_COLUMNS + (["headshot_b64"] if with_images else [])
+    if not person_ids:
+        return pd.DataFrame(columns=cols)
+
+    query = sql.SQL("SELECT {cols} FROM people_with_faces WHERE person_id = ANY(%s)").format(
+        cols=sql.SQL(", ").join(map(sql.Identifier, cols))
+    )
+
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(query, (person_ids,))
+        rows = cur.fetchall()
+        col_names = [desc[0] for desc in cur.description]
+    return pd.DataFrame(rows, columns=col_names)
+
+def get_candidate_by_id(person_id, with_images=True):
+    df = get_candidates_by_ids([person_id], with_images=with_images)
+    return None if df.empty else df.iloc[0].to_dict()
+
+def _fetch_by_ids(person_ids, column):
+    person_ids = sorted({int(pid) for pid in person_ids if pd.notna(pid)})
+    if not person_ids:
+        return {}
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(sql.SQL("SELECT person_id, {} FROM people_with_faces WHERE person_id = ANY(%s)").format(
+            sql.Identifier(column)), (person_ids,))
+        return dict(cur.fetchall())
+
+def fetch_headshots(person_ids):
+    # person_id -> headshot_b64 in one round trip, for the final displayed set
+    return _fetch_by_ids(person_ids, "headshot_b64")
+
+def fetch_embeddings(person_ids):
+    # person_id -> stored face_embedding (float32 array) in one round trip
+    return _fetch_by_ids(person_ids, "face_embedding")